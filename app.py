@@ -1,5 +1,6 @@
-from flask import Flask, render_template, request, jsonify, session, Response
+from flask import Flask, Blueprint, render_template, request, jsonify, session, Response
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
 import requests
 import os
 from dotenv import load_dotenv
@@ -9,107 +10,462 @@ from datetime import datetime
 import time
 import threading
 import json
-import azure.cognitiveservices.speech as speechsdk
+import queue
+import hashlib
+import math
+from email.utils import parsedate_to_datetime
 import traceback
+import re
+import contextlib
+import importlib
+from collections import OrderedDict, deque
 from pathlib import Path
+from xml.sax.saxutils import escape
+import traffic_capture
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
 env_path = Path('.') / '.env'
-load_dotenv(env_path)
 
-# Validate required environment variables
-required_vars = ['DIRECT_LINE_SECRET', 'SPEECH_REGION', 'SPEECH_KEY']
-missing_vars = [var for var in required_vars if not os.getenv(var)]
-if missing_vars:
-    logger.error(f"Missing required environment variables: {', '.join(missing_vars)}")
+# Importing this module has no side effects: create_app() loads the environment and builds
+# the Flask app, background refreshers start on the first request in each (forked) process,
+# and the Speech SDK is imported on first avatar use. Run with gunicorn "app:create_app()".
+bp = Blueprint('main', __name__)
+csrf = CSRFProtect()
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-development-secret-key-here')  # Fallback for development
-csrf = CSRFProtect(app)
+# Time taken by each startup stage in ms, including the lazy ones
+startup_timings = OrderedDict()
+
+@contextlib.contextmanager
+def startup_stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Startup stage {name} took {startup_timings[name]} ms")
+
+class LazySpeechSDK:
+    """Stand-in for azure.cognitiveservices.speech that imports the native module on first use."""
+
+    _lock = threading.Lock()
+
+    def __getattr__(self, name):
+        global speechsdk
+        with self._lock:
+            if isinstance(speechsdk, LazySpeechSDK):
+                with startup_stage('speech_sdk_import'):
+                    speechsdk = importlib.import_module('azure.cognitiveservices.speech')
+        return getattr(speechsdk, name)
+
+speechsdk = LazySpeechSDK()
 
 # Speech token management
 speech_token = None
-speech_region = os.getenv('SPEECH_REGION')
-speech_key = os.getenv('SPEECH_KEY')
+speech_token_region = None  # Region the current speech token was issued for
+speech_region = None
+speech_key = None
 ice_token = None  # Global ICE token that gets refreshed automatically
+ice_token_region = None  # Region the current ICE token was issued for
+
+# Speech service endpoints per region; point the templates at local stand-ins for testing
+SPEECH_STS_URL = 'https://{region}.api.cognitive.microsoft.com/sts/v1.0/issueToken'
+SPEECH_RELAY_URL = 'https://{region}.tts.speech.microsoft.com/cognitiveservices/avatar/relay/token/v1'
+SPEECH_AVATAR_URL = 'wss://{region}.tts.speech.microsoft.com/cognitiveservices/websocket/v1?enableTalkingAvatar=true'
+SPEECH_TTS_URL = 'wss://{region}.tts.speech.microsoft.com/cognitiveservices/websocket/v1'
+SPEECH_PROBE_INTERVAL = 60  # Seconds between region probes
+SPEECH_TOKEN_REUSE_AGE = 300  # Reuse a prober's speech token up to this old (tokens are valid for 10 minutes)
+SPEECH_REQUEST_TIMEOUT = 10
+MAX_REGION_FAILURES = 3  # Consecutive failures before a region is considered down
+
+# Health of every configured Speech region: SPEECH_REGION/SPEECH_KEY plus the failover regions
+# in SPEECH_REGIONS, a comma-separated list of "region" or "region=key" (key defaults to SPEECH_KEY)
+speech_regions = {}
+speech_regions_lock = threading.Lock()
+
+def configure_speech_regions():
+    """(Re)build the region list from the environment, keeping known regions' health."""
+    configured = OrderedDict()
+    if speech_region:
+        configured[speech_region] = speech_key
+    for entry in os.getenv('SPEECH_REGIONS', '').split(','):
+        region, _, key = entry.strip().partition('=')
+        if region.strip():
+            configured.setdefault(region.strip(), key.strip() or speech_key)
+
+    with speech_regions_lock:
+        previous = dict(speech_regions)
+        speech_regions.clear()
+        for region, key in configured.items():
+            state = previous.get(region) or {'latency_ms': None, 'error_rate': 0.0, 'failures': 0,
+                                              'last_probe': None, 'speech_token': None, 'speech_token_at': 0,
+                                              'ice_token': None}
+            state['key'] = key
+            speech_regions[region] = state
+
+def record_region_result(region, ok, latency_ms=None):
+    """Fold one call's outcome into the region's moving-average latency and error rate."""
+    with speech_regions_lock:
+        state = speech_regions.get(region)
+        if not state:
+            return
+        state['error_rate'] = 0.7 * state['error_rate'] + 0.3 * (0.0 if ok else 1.0)
+        state['failures'] = 0 if ok else state['failures'] + 1
+        if ok and latency_ms is not None:
+            state['latency_ms'] = latency_ms if state['latency_ms'] is None else 0.7 * state['latency_ms'] + 0.3 * latency_ms
+        state['last_probe'] = time.time()
+
+def is_speech_region_healthy(region):
+    with speech_regions_lock:
+        state = speech_regions.get(region)
+        return bool(state) and state['failures'] < MAX_REGION_FAILURES and state['error_rate'] < 0.5
+
+def ranked_speech_regions():
+    """Return regions best first: healthy ones by latency, then the rest by how badly they fail."""
+    with speech_regions_lock:
+        states = list(speech_regions.items())
+    healthy = [(region, state) for region, state in states
+               if state['failures'] < MAX_REGION_FAILURES and state['error_rate'] < 0.5]
+    unhealthy = [(region, state) for region, state in states if (region, state) not in healthy]
+    healthy.sort(key=lambda item: item[1]['latency_ms'] if item[1]['latency_ms'] is not None else float('inf'))
+    unhealthy.sort(key=lambda item: (item[1]['failures'], item[1]['error_rate']))
+    return [region for region, _ in healthy + unhealthy]
+
+def select_speech_region():
+    ranked = ranked_speech_regions()
+    return ranked[0] if ranked else speech_region
+
+def speech_region_key(region):
+    with speech_regions_lock:
+        return speech_regions.get(region, {}).get('key') or speech_key
+
+def speech_region_speech_token(region):
+    """Return the prober's cached speech token for the region if it is still fresh."""
+    with speech_regions_lock:
+        state = speech_regions.get(region, {})
+        if state.get('speech_token') and time.time() - state['speech_token_at'] < SPEECH_TOKEN_REUSE_AGE:
+            return state['speech_token']
+        return None
+
+def speech_region_ice_token(region):
+    with speech_regions_lock:
+        return speech_regions.get(region, {}).get('ice_token')
+
+def fetch_speech_token(region):
+    """Issue a speech token in the region, recording the call's latency and outcome."""
+    started = time.perf_counter()
+    try:
+        response = requests.post(
+            SPEECH_STS_URL.format(region=region),
+            headers={'Ocp-Apim-Subscription-Key': speech_region_key(region)},
+            timeout=SPEECH_REQUEST_TIMEOUT
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing speech token in {region}: {str(e)}")
+        record_region_result(region, False)
+        return None
+    if response.status_code == 200:
+        record_region_result(region, True, (time.perf_counter() - started) * 1000)
+        return response.text
+    logger.error(f"Failed to refresh speech token in {region}: {response.status_code} {response.text}")
+    record_region_result(region, False)
+    return None
+
+def fetch_ice_token(region):
+    """Fetch a relay (ICE) token in the region, recording the call's latency and outcome."""
+    started = time.perf_counter()
+    try:
+        response = requests.get(
+            SPEECH_RELAY_URL.format(region=region),
+            headers={'Ocp-Apim-Subscription-Key': speech_region_key(region)},
+            timeout=SPEECH_REQUEST_TIMEOUT
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing ICE token in {region}: {str(e)}")
+        record_region_result(region, False)
+        return None
+    if response.status_code != 200:
+        logger.error(f"Failed to refresh ICE token in {region}: {response.status_code} {response.text}")
+        record_region_result(region, False)
+        return None
+    # Verify the token is valid JSON
+    try:
+        json.loads(response.text)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid ICE token format from {region}: {str(e)}")
+        logger.error(f"Raw token: {response.text[:100]}...")
+        record_region_result(region, False)
+        return None
+    record_region_result(region, True, (time.perf_counter() - started) * 1000)
+    return response.text
+
+def update_speech_token():
+    """Take a speech token from the best region, using the prober's cached token while it is fresh."""
+    global speech_token, speech_token_region
+    for region in ranked_speech_regions():
+        token = speech_region_speech_token(region) or fetch_speech_token(region)
+        if token:
+            speech_token, speech_token_region = token, region
+            logger.debug(f"Speech token refreshed successfully in {region}")
+            return True
+    return False
+
+def update_ice_token():
+    """Take an ICE token from the best region, using the prober's cached token when there is one."""
+    global ice_token, ice_token_region
+    for region in ranked_speech_regions():
+        token = speech_region_ice_token(region) or fetch_ice_token(region)
+        if token:
+            ice_token, ice_token_region = token, region
+            logger.debug(f"ICE token refreshed successfully in {region}")
+            return True
+    return False
 
 def refresh_speech_token():
     """Refresh the speech token every 9 minutes."""
-    global speech_token
     while True:
-        try:
-            response = requests.post(
-                f'https://{speech_region}.api.cognitive.microsoft.com/sts/v1.0/issueToken',
-                headers={'Ocp-Apim-Subscription-Key': speech_key}
-            )
-            if response.status_code == 200:
-                speech_token = response.text
-                logger.debug("Speech token refreshed successfully")
-            else:
-                logger.error(f"Failed to refresh speech token: {response.status_code} {response.text}")
-        except Exception as e:
-            logger.error(f"Error refreshing speech token: {str(e)}")
+        update_speech_token()
         time.sleep(540)  # Sleep for 9 minutes
 
 def refresh_ice_token():
-    """Refresh the ICE token every 24 hours."""
-    global ice_token
+    """Fetch the first ICE token, retrying every minute; the region prober keeps it fresh after that."""
     while True:
-        try:
-            # Check if speech key and region are set
-            if not speech_key or not speech_region:
-                logger.error("Speech key or region not set, cannot refresh ICE token")
-                time.sleep(60)  # Wait a minute before retrying
-                continue
-                
-            logger.debug("Attempting to refresh ICE token")
-            response = requests.get(
-                f'https://{speech_region}.tts.speech.microsoft.com/cognitiveservices/avatar/relay/token/v1',
-                headers={'Ocp-Apim-Subscription-Key': speech_key}
-            )
-            
-            if response.status_code == 200:
-                ice_token = response.text
-                logger.debug("ICE token refreshed successfully")
-                # Verify the token is valid JSON
-                try:
-                    json.loads(ice_token)
-                    logger.debug("ICE token is valid JSON")
-                except json.JSONDecodeError as e:
-                    logger.error(f"Invalid ICE token format: {str(e)}")
-                    logger.error(f"Raw token: {ice_token[:100]}...")
-                    ice_token = None
-            else:
-                logger.error(f"Failed to refresh ICE token: {response.status_code} {response.text}")
-                ice_token = None
-                
-        except Exception as e:
-            logger.error(f"Error refreshing ICE token: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            ice_token = None
-            
-        # If this is the first run and we got a token, break the loop
-        if ice_token:
+        # Check if speech key and region are set
+        if not speech_key or not speech_region:
+            logger.error("Speech key or region not set, cannot refresh ICE token")
+        elif update_ice_token():
             break
-            
         time.sleep(60)  # Wait a minute before retrying
 
-# Start the speech token refresh thread
-speech_token_thread = threading.Thread(target=refresh_speech_token)
-speech_token_thread.daemon = True
-speech_token_thread.start()
+def probe_speech_regions():
+    """Measure token and relay latency and errors in every region, caching their tokens.
+
+    After each probe the global tokens are taken from the best region, so they stay fresh
+    and switch over when the best region changes.
+    """
+    while True:
+        for region in list(speech_regions):
+            token = fetch_speech_token(region)
+            relay_token = fetch_ice_token(region)
+            with speech_regions_lock:
+                state = speech_regions.get(region)
+                if state:
+                    if token:
+                        state['speech_token'], state['speech_token_at'] = token, time.time()
+                    state['ice_token'] = relay_token or state['ice_token']
+
+        # Refresh the global tokens from the freshly cached ones, without further calls
+        best = select_speech_region()
+        if best and best != speech_token_region:
+            logger.info(f"Switching speech token to region {best}")
+        if best and best != ice_token_region:
+            logger.info(f"Switching ICE token to region {best}")
+        update_speech_token()
+        update_ice_token()
+        time.sleep(SPEECH_PROBE_INTERVAL)
+
+# Background refresher threads, started once per process by start_background_tasks()
+speech_token_thread = None
+ice_token_thread = None
+region_probe_thread = None
+background_tasks_pid = None
+background_tasks_lock = threading.Lock()
+
+def start_background_tasks():
+    """Start the token refreshers and region prober once per process.
+
+    Runs on the first request, so under a pre-forking server each worker starts its own
+    threads after the fork instead of inheriting dead ones from the master.
+    """
+    global speech_token_thread, ice_token_thread, region_probe_thread, background_tasks_pid
+    if background_tasks_pid == os.getpid():
+        return
+    with background_tasks_lock:
+        if background_tasks_pid == os.getpid():
+            return
+        with startup_stage('background_tasks'):
+            # Start the speech token refresh thread
+            speech_token_thread = threading.Thread(target=refresh_speech_token)
+            speech_token_thread.daemon = True
+            speech_token_thread.start()
 
-# Start the ICE token refresh thread
-ice_token_thread = threading.Thread(target=refresh_ice_token)
-ice_token_thread.daemon = True
-ice_token_thread.start()
+            # Start the ICE token refresh thread
+            ice_token_thread = threading.Thread(target=refresh_ice_token)
+            ice_token_thread.daemon = True
+            ice_token_thread.start()
+
+            # Start the Speech region health prober
+            region_probe_thread = threading.Thread(target=probe_speech_regions)
+            region_probe_thread.daemon = True
+            region_probe_thread.start()
+        background_tasks_pid = os.getpid()
 
 # DirectLine API Configuration
 DIRECTLINE_URL = "https://directline.botframework.com/v3/directline"
+directline_transport = requests  # Swapped for a stand-in by traffic_capture replay
+
+DIRECTLINE_RATE = 8.0  # Sustained calls per second per bot
+DIRECTLINE_BURST = 16
+DIRECTLINE_MAX_RETRIES = 3  # Retries of a throttled (429) call after backing off
+
+class DirectLineGovernor:
+    """Process-wide token-bucket budget for DirectLine calls, one bucket per bot secret.
+
+    Background polls ("low" priority) leave a reserve of the bucket for send_message and
+    conversation setup ("high"), and wait while any high-priority call is waiting. A 429
+    blocks the whole bucket until its Retry-After has passed (exponential backoff if absent);
+    callers that would have to wait past max_wait for it are turned away instead.
+    """
+
+    def __init__(self, rate, burst, poll_reserve=0.25, max_wait=30):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = burst * poll_reserve
+        self.max_wait = max_wait
+        self._buckets = {}  # key -> [tokens, last refill time]
+        self._blocked_until = {}  # key -> monotonic time the shared backoff ends
+        self._throttle_streak = {}
+        self._high_waiting = {}
+        self._cond = threading.Condition()
+        self.counters = {'calls': 0, 'deferred': 0, 'deferred_polls': 0, 'throttled': 0, 'wait_timeouts': 0,
+                         'backoff_rejections': 0}
+
+    def _tokens(self, key, now):
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        self._buckets[key] = [tokens, now]
+        return tokens
+
+    def acquire(self, key, priority='high'):
+        """Block until the call fits the budget and return True.
+
+        Returns False at once if the bucket's 429 backoff lasts longer than the remaining
+        max_wait; a call still waiting for bucket tokens after max_wait proceeds anyway.
+        """
+        deadline = time.monotonic() + self.max_wait
+        deferred = False
+        with self._cond:
+            self.counters['calls'] += 1
+            if priority == 'high':
+                self._high_waiting[key] = self._high_waiting.get(key, 0) + 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    tokens = self._tokens(key, now)
+                    blocked_for = self._blocked_until.get(key, 0) - now
+                    needed = 1 if priority == 'high' else 1 + self.reserve
+                    yields = priority != 'high' and self._high_waiting.get(key, 0) > 0
+                    if blocked_for > deadline - now:
+                        self.counters['backoff_rejections'] += 1
+                        return False
+                    if blocked_for <= 0 and tokens >= needed and not yields:
+                        self._buckets[key][0] -= 1
+                        return True
+                    if not deferred:
+                        deferred = True
+                        self.counters['deferred'] += 1
+                        if priority != 'high':
+                            self.counters['deferred_polls'] += 1
+                    if now >= deadline:
+                        self.counters['wait_timeouts'] += 1
+                        logger.warning(f"DirectLine call proceeding after waiting {self.max_wait}s for budget")
+                        return True
+                    wait = blocked_for if blocked_for > 0 else max((needed - tokens) / self.rate, 0.05)
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                if priority == 'high':
+                    self._high_waiting[key] -= 1
+                    self._cond.notify_all()
+
+    def throttled(self, key, retry_after=None):
+        """Back off every caller of the bucket after a 429."""
+        with self._cond:
+            self.counters['throttled'] += 1
+            streak = self._throttle_streak.get(key, 0) + 1
+            self._throttle_streak[key] = streak
+            delay = retry_after if retry_after is not None else min(60, 2 ** streak)
+            now = time.monotonic()
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0), now + delay)
+            self._tokens(key, now)
+            self._buckets[key][0] = 0
+            self._cond.notify_all()
+            return delay
+
+    def backoff_remaining(self, key):
+        with self._cond:
+            return max(0, self._blocked_until.get(key, 0) - time.monotonic())
+
+    def succeeded(self, key):
+        with self._cond:
+            self._throttle_streak.pop(key, None)
+
+    def status(self):
+        with self._cond:
+            now = time.monotonic()
+            return {
+                'counters': dict(self.counters),
+                'buckets': {key: {
+                    'tokens': round(self._tokens(key, now), 2),
+                    'backoff_remaining': round(max(0, self._blocked_until.get(key, 0) - now), 2)
+                } for key in list(self._buckets)}
+            }
+
+directline_governor = DirectLineGovernor(DIRECTLINE_RATE, DIRECTLINE_BURST)
+
+def parse_retry_after(value):
+    """Return the Retry-After header as seconds, from either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class DirectLineThrottled(Exception):
+    """DirectLine is still throttling after the retries; retry_after is in seconds (None if unknown)."""
+    def __init__(self, retry_after=None):
+        super().__init__(f"DirectLine throttled, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def raise_if_throttled(response):
+    if response.status_code == 429:
+        raise DirectLineThrottled(parse_retry_after(response.headers.get('Retry-After')))
+
+def directline_request(method, url, **kwargs):
+    """Make a DirectLine HTTP call within the shared rate budget, recording it when traffic capture is enabled.
+
+    Throttled calls are retried after the shared backoff; polls yield to message sends. When
+    the backoff outlasts the governor's max_wait, a 429 is returned without calling DirectLine.
+    """
+    stage = traffic_capture.directline_stage(method, url)
+    priority = 'low' if stage == 'directline.get_activities' else 'high'
+    budget_key = hashlib.sha256(os.getenv('DIRECT_LINE_SECRET', '').encode()).hexdigest()[:12]
+    for attempt in range(DIRECTLINE_MAX_RETRIES + 1):
+        if not directline_governor.acquire(budget_key, priority):
+            retry_after = math.ceil(directline_governor.backoff_remaining(budget_key))
+            logger.warning(f"DirectLine {stage} not attempted, shared backoff has {retry_after}s left")
+            response = requests.Response()
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            response._content = f"DirectLine throttled, retry after {retry_after}s".encode()
+            return response
+        with traffic_capture.span(stage, method=method, request=kwargs.get('json')) as event:
+            response = directline_transport.request(method, url, **kwargs)
+            event['status'] = response.status_code
+            try:
+                event['response'] = response.json()
+            except ValueError:
+                event['response'] = response.text
+        if response.status_code != 429:
+            directline_governor.succeeded(budget_key)
+            return response
+        delay = directline_governor.throttled(budget_key, parse_retry_after(response.headers.get('Retry-After')))
+        logger.warning(f"DirectLine throttled {stage} (attempt {attempt + 1}), backing off {delay:.1f}s")
+    return response
 
 def generate_directline_token():
     """Generate a DirectLine token for the conversation."""
@@ -119,9 +475,10 @@ def generate_directline_token():
     
     try:
         logger.debug("Attempting to generate DirectLine token")
-        response = requests.post(f"{DIRECTLINE_URL}/tokens/generate", headers=headers)
+        response = directline_request('POST', f"{DIRECTLINE_URL}/tokens/generate", headers=headers)
         logger.debug(f"Token generation response status: {response.status_code}")
         logger.debug(f"Token response content: {response.text}")
+        raise_if_throttled(response)
         
         if response.status_code == 200:
             data = response.json()
@@ -133,12 +490,14 @@ def generate_directline_token():
             logger.error(f"Failed to generate token. Status: {response.status_code}, Response: {response.text}")
             return None
             
+    except DirectLineThrottled:
+        raise
     except Exception as e:
         logger.error(f"Error generating token: {str(e)}")
         return None
 
 def start_conversation():
-    """Start a new conversation with the bot."""
+    """Start a new conversation with the bot; raises DirectLineThrottled while DirectLine throttles."""
     # First, generate a DirectLine token
     token_data = generate_directline_token()
     if not token_data:
@@ -150,9 +509,10 @@ def start_conversation():
     }
     
     try:
-        response = requests.post(f"{DIRECTLINE_URL}/conversations", headers=headers)
+        response = directline_request('POST', f"{DIRECTLINE_URL}/conversations", headers=headers)
         logger.debug(f"Start conversation response status: {response.status_code}")
         logger.debug(f"Response content: {response.text}")
+        raise_if_throttled(response)
         
         if response.status_code == 201:
             data = response.json()
@@ -169,12 +529,18 @@ def start_conversation():
             logger.error(f"Failed to start conversation: {response.text}")
             return None
             
+    except DirectLineThrottled:
+        raise
     except Exception as e:
         logger.error(f"Error starting conversation: {str(e)}")
         return None
 
 def send_message(conversation_id, message, token):
-    """Send a message to the bot and return the message ID."""
+    """Send a message to the bot and return the message ID.
+
+    Returns None if the message was rejected, e.g. because the token expired, and raises
+    DirectLineThrottled if DirectLine is still throttling, which a new conversation won't fix.
+    """
     if not conversation_id or not token:
         logger.error("Missing conversation ID or token")
         return None
@@ -198,14 +564,17 @@ def send_message(conversation_id, message, token):
         logger.debug(f"Sending message to URL: {url}")
         logger.debug(f"Message payload: {payload}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = directline_request('POST', url, headers=headers, json=payload)
         logger.debug(f"Send message response status: {response.status_code}")
         logger.debug(f"Response content: {response.text}")
+        raise_if_throttled(response)
         
         if response.status_code == 200 or response.status_code == 201:
             data = response.json()
             return data.get('id')  # Return the message ID
         return None
+    except DirectLineThrottled:
+        raise
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
         return None
@@ -235,7 +604,7 @@ def get_bot_response(conversation_id, token, user_message_id):
     try:
         url = f"{DIRECTLINE_URL}/conversations/{conversation_id}/activities"
         logger.debug(f"Getting response from URL: {url}")
-        response = requests.get(url, headers=headers)
+        response = directline_request('GET', url, headers=headers)
         logger.debug(f"Get response status: {response.status_code}")
         
         if response.status_code == 200:
@@ -303,7 +672,7 @@ def get_bot_response(conversation_id, token, user_message_id):
                         logger.debug(f"Polling for bot response... ({elapsed_time}s elapsed)")
                         
                         # Get fresh activities
-                        response = requests.get(url, headers=headers)
+                        response = directline_request('GET', url, headers=headers)
                         if response.status_code == 200:
                             data = response.json()
                             activities = data.get('activities', [])
@@ -354,7 +723,120 @@ def get_bot_response(conversation_id, token, user_message_id):
         logger.error(f"Error getting bot response: {str(e)}")
         return None
 
-@app.route('/')
+class TranscriptStore:
+    """Append-only, memory-bounded chat transcripts keyed by DirectLine conversation ID.
+
+    Each conversation keeps its newest entries in memory; older ones are spilled to a
+    JSONL file when a spill directory is configured, otherwise dropped. Conversations
+    idle longer than max_age, or the least recently used ones once the store exceeds
+    max_bytes / max_conversations, are evicted along with their spill files. Spill files
+    live in a store-owned transcript-spill subdirectory and belong to the process that
+    wrote them: leftovers from earlier processes are cleared on startup, and a
+    conversation's file is truncated when its state is created.
+    """
+
+    def __init__(self, max_entries=200, max_conversations=500, max_bytes=5 * 1024 * 1024,
+                 max_age=24 * 3600, spill_dir=None):
+        self.max_entries = max_entries
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.spill_dir = Path(spill_dir) / 'transcript-spill' if spill_dir else None
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # Entries spilled by an earlier process can't be reached from this one's cursors
+            for stale in self.spill_dir.glob('*.jsonl'):
+                stale.unlink(missing_ok=True)
+        self._conversations = OrderedDict()  # conversation_id -> state, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _spill_path(self, conversation_id):
+        return self.spill_dir / f"{re.sub(r'[^A-Za-z0-9_-]', '_', conversation_id)}.jsonl"
+
+    def append(self, conversation_id, role, text):
+        """Append a message and return its cursor."""
+        with self._lock:
+            state = self._conversations.get(conversation_id)
+            if state is None:
+                state = {'entries': deque(), 'next_id': 1, 'spilled': 0, 'updated': time.time()}
+                self._conversations[conversation_id] = state
+                if self.spill_dir:
+                    self._spill_path(conversation_id).unlink(missing_ok=True)
+            entry = {'id': state['next_id'], 'role': role, 'text': text, 'ts': datetime.utcnow().isoformat() + 'Z'}
+            state['next_id'] += 1
+            state['entries'].append(entry)
+            state['updated'] = time.time()
+            self._conversations.move_to_end(conversation_id)
+            self._bytes += len(text)
+
+            while len(state['entries']) > self.max_entries:
+                old = state['entries'].popleft()
+                self._bytes -= len(old['text'])
+                if self.spill_dir:
+                    with open(self._spill_path(conversation_id), 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(old) + '\n')
+                    state['spilled'] = old['id']
+
+            self._evict()
+            return entry['id']
+
+    def _evict(self):
+        """Drop expired conversations, then the least recently used ones until within limits."""
+        cutoff = time.time() - self.max_age
+        for conversation_id in [cid for cid, state in self._conversations.items() if state['updated'] < cutoff]:
+            self._drop(conversation_id)
+        while len(self._conversations) > 1 and (len(self._conversations) > self.max_conversations
+                                                or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._conversations)))
+
+    def _drop(self, conversation_id):
+        state = self._conversations.pop(conversation_id)
+        self._bytes -= sum(len(entry['text']) for entry in state['entries'])
+        if self.spill_dir and state['spilled']:
+            self._spill_path(conversation_id).unlink(missing_ok=True)
+        logger.debug(f"Evicted transcript for conversation {conversation_id}")
+
+    def fetch(self, conversation_id, after=0, limit=50):
+        """Return up to limit entries with a cursor greater than after, and whether more remain."""
+        with self._lock:
+            state = self._conversations.get(conversation_id)
+            if state is None:
+                return [], False
+            results = []
+            if after < state['spilled']:
+                with open(self._spill_path(conversation_id), encoding='utf-8') as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if entry['id'] > after:
+                            results.append(entry)
+                            if len(results) > limit:
+                                break
+            if len(results) <= limit:
+                results.extend(entry for entry in state['entries'] if entry['id'] > after)
+            return results[:limit], len(results) > limit
+
+    def fetch_before(self, conversation_id, before=None, limit=50):
+        """Return the newest limit entries with a cursor less than before (or overall), and whether older ones remain."""
+        with self._lock:
+            state = self._conversations.get(conversation_id)
+            if state is None:
+                return [], False
+            results = [entry for entry in state['entries'] if before is None or entry['id'] < before]
+            if len(results) <= limit and state['spilled']:
+                bound = results[0]['id'] if results else before
+                spilled = deque(maxlen=limit + 1 - len(results))
+                with open(self._spill_path(conversation_id), encoding='utf-8') as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if bound is None or entry['id'] < bound:
+                            spilled.append(entry)
+                results = list(spilled) + results
+            return results[-limit:], len(results) > limit
+
+transcript_store = TranscriptStore()  # Rebuilt from the environment by load_settings()
+
+@bp.route('/')
 def home():
     # Generate client ID if not in session
     if 'client_id' not in session:
@@ -394,8 +876,23 @@ def home():
     
     return render_template('index.html', **template_vars)
 
-@app.route('/chat', methods=['POST'])
+def throttled_response(e):
+    """Tell the browser DirectLine is throttling and when to try again."""
+    logger.warning(f"Chat message not sent: {e}")
+    response = jsonify({'error': 'The bot is busy, please try again shortly', 'retry_after': e.retry_after})
+    response.status_code = 429
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+    return response
+
+@bp.route('/chat', methods=['POST'])
 def chat():
+    try:
+        return send_chat_message()
+    except DirectLineThrottled as e:
+        return throttled_response(e)
+
+def send_chat_message():
     message = request.json.get('message')
     if not message:
         return jsonify({'error': 'No message provided'}), 400
@@ -440,33 +937,72 @@ def chat():
         else:
             return jsonify({'error': 'Failed to refresh token'}), 500
     
+    user_cursor = transcript_store.append(conversation_id, 'user', message)
+    
+    # Mask the bot's thinking time with a filler on the client's avatar, if it has one
+    client_id = request.headers.get('ClientId', session.get('client_id', 'default_client'))
+    filler_timer = schedule_thinking_filler(client_id)
+    
     # Get bot's response with retries
     max_retries = 5
     retry_count = 0
     
-    while retry_count < max_retries:
-        response = get_bot_response(conversation_id, token, message_id)
-        if response:
-            session['watermark'] = response['watermark']
-            return jsonify({'response': response['text']})
-        retry_count += 1
-        time.sleep(2)  # Wait longer between retries
+    try:
+        while retry_count < max_retries:
+            response = get_bot_response(conversation_id, token, message_id)
+            if response:
+                session['watermark'] = response['watermark']
+                cursor = transcript_store.append(conversation_id, 'bot', response['text'])
+                return jsonify({'response': response['text'], 'cursor': cursor, 'user_cursor': user_cursor})
+            retry_count += 1
+            time.sleep(2)  # Wait longer between retries
+    finally:
+        if filler_timer:
+            filler_timer.cancel()
     
     return jsonify({'error': 'No response from bot after retries'}), 500
 
-@app.route("/api/getSpeechToken", methods=["GET"])
+@bp.route('/api/transcript', methods=['GET'])
+def get_transcript():
+    """Return a page of the session's transcript.
+
+    With after=<cursor>, pages forward and has_more means newer entries remain. Without it,
+    returns the newest page (before=<cursor> pages back from there) and has_more means
+    older entries remain.
+    """
+    conversation = session.get('conversation')
+    if not conversation:
+        return jsonify({'messages': [], 'cursor': 0, 'has_more': False})
+
+    try:
+        after, before = (int(request.args[name]) if name in request.args else None for name in ('after', 'before'))
+        limit = min(int(request.args.get('limit', 50)), 200)
+    except ValueError:
+        return jsonify({'error': 'after, before and limit must be integers'}), 400
+
+    if after is not None:
+        messages, has_more = transcript_store.fetch(conversation['conversation_id'], after, limit)
+    else:
+        messages, has_more = transcript_store.fetch_before(conversation['conversation_id'], before, limit)
+    return jsonify({
+        'messages': messages,
+        'cursor': messages[-1]['id'] if messages else (after or 0),
+        'has_more': has_more
+    })
+
+@bp.route("/api/getSpeechToken", methods=["GET"])
 @csrf.exempt  # Exempt this endpoint from CSRF protection
 def get_speech_token():
     """Return the speech token and region"""
     global speech_token
     if not speech_token:
-        refresh_speech_token()  # Make sure we have a token
+        update_speech_token()  # Make sure we have a token
     
     response = Response(speech_token, status=200)
-    response.headers['SpeechRegion'] = os.getenv('SPEECH_REGION')
+    response.headers['SpeechRegion'] = speech_token_region or os.getenv('SPEECH_REGION')
     return response
 
-@app.route("/api/getIceToken", methods=["GET"])
+@bp.route("/api/getIceToken", methods=["GET"])
 @csrf.exempt  # Exempt this endpoint from CSRF protection
 def get_ice_token():
     """Return the ICE token for WebRTC connection"""
@@ -486,26 +1022,16 @@ def get_ice_token():
             
         if ice_token is None:
             logger.error("ICE token not available after retries")
-            # Try to refresh the token immediately
-            try:
-                response = requests.get(
-                    f'https://{speech_region}.tts.speech.microsoft.com/cognitiveservices/avatar/relay/token/v1',
-                    headers={'Ocp-Apim-Subscription-Key': speech_key}
-                )
-                if response.status_code == 200:
-                    ice_token = response.text
-                    logger.debug("ICE token refreshed successfully")
-                else:
-                    logger.error(f"Failed to refresh ICE token: {response.status_code} {response.text}")
-                    return Response(f"Failed to get ICE token: {response.text}", status=response.status_code)
-            except Exception as e:
-                logger.error(f"Error refreshing ICE token: {str(e)}")
-                return Response(f"Error getting ICE token: {str(e)}", status=500)
+            # Try to refresh the token immediately, from any region that can issue one
+            if not update_ice_token():
+                return Response("Failed to get ICE token from any Speech region", status=503)
         
         try:
-            # Return the global ICE token
+            # Return the global ICE token and the region it was issued for
             ice_token_obj = json.loads(ice_token)
-            return jsonify(ice_token_obj)
+            response = jsonify(ice_token_obj)
+            response.headers['SpeechRegion'] = ice_token_region or speech_region
+            return response
         except json.JSONDecodeError as e:
             logger.error(f"Error parsing ICE token: {str(e)}")
             logger.error(f"Raw ICE token: {ice_token[:100]}...")
@@ -520,8 +1046,538 @@ def get_ice_token():
 avatar_connections = {}
 speech_synthesizers = {}
 
+avatar_voices = {}  # client_id -> TTS voice the avatar was connected with
+avatar_regions = {}  # client_id -> Speech region serving the avatar session
+MAX_CONNECT_REGIONS = 2  # Regions to try before a new avatar session gives up
+
+def is_region_failure(result):
+    """Whether a canceled result reflects the region's health rather than the request or capacity."""
+    return result.cancellation_details.error_code in (
+        speechsdk.CancellationErrorCode.ConnectionFailure,
+        speechsdk.CancellationErrorCode.ServiceTimeout,
+        speechsdk.CancellationErrorCode.ServiceError
+    )
+
+def create_avatar_session(region, client_id, voice_name, avatar_config):
+    """Create a synthesizer and avatar connection in the region and initialize it with an empty speak.
+
+    Returns (speech_synthesizer, connection, result); a result canceled by a connection failure,
+    timeout or service error counts as a region failure. Speech events are forwarded to the
+    browser only once the caller adopts the session.
+    """
+    logger.debug(f"Creating speech config with region: {region}")
+    speech_config = speechsdk.SpeechConfig(
+        subscription=speech_region_key(region),
+        endpoint=SPEECH_AVATAR_URL.format(region=region)
+    )
+    speech_config.speech_synthesis_voice_name = voice_name
+
+    # Create speech synthesizer
+    logger.debug("Creating speech synthesizer")
+    speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+
+    # Set up connection to avatar service and set the avatar configuration
+    logger.debug("Setting up connection to avatar service")
+    connection = speechsdk.Connection.from_speech_synthesizer(speech_synthesizer)
+    connection.set_message_property('speech.config', 'context', json.dumps(avatar_config))
+    monitor_avatar_connection(client_id, connection)
+
+    # Initialize the connection with an empty speak
+    logger.debug("Initializing the connection with an empty speak")
+    talking_avatar = avatar_config['synthesis']['video']['talkingAvatar']
+    with traffic_capture.span('speech.connect', client_id=client_id, region=region, voice=voice_name,
+                              character=talking_avatar['character'], style=talking_avatar['style']) as event:
+        result = speech_synthesizer.speak_text_async('').get()
+        event['reason'] = str(result.reason)
+    logger.debug(f"Initial speak result reason: {result.reason}")
+    if result.reason == speechsdk.ResultReason.Canceled and is_region_failure(result):
+        record_region_result(region, False)
+    return speech_synthesizer, connection, result
+
+# Speech lifecycle events (started, word boundary, completed, canceled) are pushed to the
+# browser over a Server-Sent Events stream per client, so turn-taking uses real timings
+# Each open stream holds a worker thread, so streams end after SPEECH_EVENT_STREAM_MAX_AGE
+# seconds and EventSource reconnects; streams only see events published in their own process.
+SPEECH_EVENT_STREAM_MAX_AGE = 300
+speech_event_subscribers = {}  # client_id -> list of queues, one per open event stream
+speech_event_lock = threading.Lock()
+
+def publish_speech_event(client_id, event, data):
+    """Send a speech lifecycle event to every open event stream of the client."""
+    with speech_event_lock:
+        subscribers = list(speech_event_subscribers.get(client_id, []))
+    for subscriber in subscribers:
+        subscriber.put((event, data))
+
+def subscribe_speech_events(client_id, speech_synthesizer):
+    """Forward the synthesizer's lifecycle events to the client's event streams."""
+    def on_started(evt):
+        publish_speech_event(client_id, 'started', {'resultId': evt.result.result_id})
+
+    def on_word_boundary(evt):
+        publish_speech_event(client_id, 'wordBoundary', {
+            'text': evt.text,
+            'audioOffset': evt.audio_offset / 10000,  # 100 ns ticks to ms
+            'duration': evt.duration.total_seconds() * 1000,
+            'boundaryType': str(evt.boundary_type)
+        })
+
+    def on_completed(evt):
+        publish_speech_event(client_id, 'completed', {
+            'resultId': evt.result.result_id,
+            'audioDuration': evt.result.audio_duration.total_seconds() * 1000
+        })
+
+    def on_canceled(evt):
+        details = evt.result.cancellation_details
+        publish_speech_event(client_id, 'canceled', {
+            'resultId': evt.result.result_id,
+            'reason': str(details.reason),
+            'errorDetails': details.error_details
+        })
+
+    speech_synthesizer.synthesis_started.connect(on_started)
+    speech_synthesizer.synthesis_word_boundary.connect(on_word_boundary)
+    speech_synthesizer.synthesis_completed.connect(on_completed)
+    speech_synthesizer.synthesis_canceled.connect(on_canceled)
+
+@bp.route("/api/speechEvents", methods=["GET"])
+def speech_events():
+    """Stream the client's speech lifecycle events as Server-Sent Events"""
+    # EventSource can't send custom headers, so the client ID comes from the query string
+    client_id = request.args.get('clientId', session.get('client_id', 'default_client'))
+    subscriber = queue.Queue()
+    with speech_event_lock:
+        speech_event_subscribers.setdefault(client_id, []).append(subscriber)
+    logger.debug(f"Speech event stream opened for client {client_id}")
+    # A drop reported while the browser was between streams would otherwise be lost
+    if avatar_drop_pending(client_id):
+        subscriber.put(('avatarDisconnected', {'region': avatar_regions.get(client_id)}))
+
+    def stream():
+        deadline = time.monotonic() + SPEECH_EVENT_STREAM_MAX_AGE
+        try:
+            yield 'retry: 2000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    event, data = subscriber.get(timeout=min(15, max(0.1, deadline - time.monotonic())))
+                except queue.Empty:
+                    yield ': keepalive\n\n'  # Keeps proxies from closing an idle stream
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            with speech_event_lock:
+                subscribers = speech_event_subscribers.get(client_id, [])
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+                if not subscribers:
+                    speech_event_subscribers.pop(client_id, None)
+            logger.debug(f"Speech event stream closed for client {client_id}")
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Avatar connection health: each session's websocket is watched through the Connection's
+# connected and disconnected events. When the current connection drops, the dead session is
+# torn down in the background and the browser is told over its event stream, so it renegotiates
+# WebRTC with an already prepared peer connection before the user's next turn.
+avatar_health = {}  # client_id -> {'connected': bool, 'since': timestamp, 'drops': n, 'dropped_at': timestamp}
+avatar_health_totals = {'drops': 0, 'recovered': 0, 'last_recovery_ms': None}
+avatar_health_lock = threading.Lock()
+
+def monitor_avatar_connection(client_id, connection):
+    """Track the health of the client's avatar connection from its connected/disconnected events."""
+    def on_connected(evt):
+        # Connections of failed region attempts or replaced sessions are not tracked
+        if avatar_connections.get(client_id) is not connection:
+            return
+        with avatar_health_lock:
+            health = avatar_health.setdefault(client_id, {'drops': 0})
+            health.update({'connected': True, 'since': time.time()})
+
+    def on_disconnected(evt):
+        if avatar_connections.get(client_id) is not connection:
+            return  # Closed on purpose by disconnect_avatar or already replaced
+        with avatar_health_lock:
+            health = avatar_health.setdefault(client_id, {'drops': 0})
+            health.update({'connected': False, 'since': time.time(), 'dropped_at': time.time()})
+            health['drops'] += 1
+            avatar_health_totals['drops'] += 1
+        logger.warning(f"Avatar connection dropped for client {client_id} (session {evt.session_id})")
+        # Don't block the SDK's callback thread with the teardown
+        threading.Thread(target=recover_avatar_session, args=(client_id, connection), daemon=True).start()
+
+    connection.connected.connect(on_connected)
+    connection.disconnected.connect(on_disconnected)
+
+def recover_avatar_session(client_id, connection):
+    """Tear down a dropped avatar session and ask the browser to negotiate a new one.
+
+    The WebRTC session is bound to the browser's SDP offer, so the replacement synthesizer and
+    connection are built by the browser's next /api/connectAvatar call, not here.
+    """
+    if avatar_connections.get(client_id) is not connection:
+        return
+    avatar_connections.pop(client_id, None)
+    speech_synthesizers.pop(client_id, None)
+    try:
+        connection.close()
+    except Exception as e:
+        logger.debug(f"Error closing dropped avatar connection for client {client_id}: {str(e)}")
+    publish_speech_event(client_id, 'avatarDisconnected', {'region': avatar_regions.get(client_id)})
+    logger.info(f"Asked client {client_id} to reconnect its avatar session")
+    notify_avatar_available()  # The dropped session's slot has freed up
+
+def avatar_drop_pending(client_id):
+    """Whether the client's avatar session dropped and the browser has not yet replaced or closed it."""
+    with avatar_health_lock:
+        dropped = 'dropped_at' in avatar_health.get(client_id, {})
+    return dropped and client_id not in avatar_connections
+
+def record_avatar_connected(client_id):
+    """Mark a new avatar session as healthy, counting it as a recovery if the last one dropped."""
+    with avatar_health_lock:
+        health = avatar_health.setdefault(client_id, {'drops': 0})
+        dropped_at = health.pop('dropped_at', None)
+        if dropped_at:
+            avatar_health_totals['recovered'] += 1
+            avatar_health_totals['last_recovery_ms'] = round((time.time() - dropped_at) * 1000)
+            logger.info(f"Avatar session for client {client_id} recovered in {avatar_health_totals['last_recovery_ms']} ms")
+        health.update({'connected': True, 'since': time.time()})
+
+# Latency-masking "thinking" filler: if the bot hasn't replied within THINKING_FILLER_DELAY
+# seconds, a short phrase is queued on the client's synthesizer. Set the delay to 0 to disable.
+THINKING_FILLER_DELAY = 2.5
+THINKING_FILLER_PHRASES = {
+    'en': ["Let me check on that.", "One moment, please.", "Good question, let me look into it.", "Just a second."],
+    'es': ["Déjame comprobarlo.", "Un momento, por favor.", "Buena pregunta, déjame ver."],
+    'fr': ["Laissez-moi vérifier.", "Un instant, s'il vous plaît.", "Bonne question, je regarde."],
+    'de': ["Einen Moment bitte.", "Lassen Sie mich das prüfen.", "Gute Frage, ich schaue nach."],
+    'it': ["Un momento, per favore.", "Fammi controllare.", "Bella domanda, verifico subito."],
+    'pt': ["Um momento, por favor.", "Deixe-me verificar.", "Boa pergunta, vou ver."],
+    'ja': ["少々お待ちください。", "確認しますね。"],
+    'zh': ["请稍等。", "让我查一下。"],
+}
+filler_rotation = {}  # client_id -> index of the next filler phrase
+
+def next_filler_phrase(client_id, locale):
+    """Return the next phrase for the locale (falling back to its language, then English) in rotation."""
+    phrases = (THINKING_FILLER_PHRASES.get(locale) or THINKING_FILLER_PHRASES.get(locale.split('-')[0])
+               or THINKING_FILLER_PHRASES['en'])
+    index = filler_rotation.get(client_id, 0)
+    filler_rotation[client_id] = index + 1
+    return phrases[index % len(phrases)]
+
+def speak_thinking_filler(client_id):
+    """Speak a short filler phrase on the client's avatar synthesizer."""
+    speech_synthesizer = speech_synthesizers.get(client_id)
+    if not speech_synthesizer:
+        return
+    voice_name = avatar_voices.get(client_id, 'en-US-JennyNeural')
+    locale = '-'.join(voice_name.split('-')[:2])
+    phrase = next_filler_phrase(client_id, locale)
+    ssml = (f"<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xml:lang='{locale}'>"
+            f"<voice name='{voice_name}'>{escape(phrase)}</voice></speak>")
+    logger.debug(f"Speaking thinking filler for client {client_id}: {phrase}")
+    try:
+        with traffic_capture.span('speech.filler', client_id=client_id) as event:
+            result = speech_synthesizer.speak_ssml_async(ssml).get()
+            event['reason'] = str(result.reason)
+    except Exception as e:
+        logger.error(f"Error speaking thinking filler for client {client_id}: {str(e)}")
+
+def schedule_thinking_filler(client_id):
+    """Queue a filler to start after THINKING_FILLER_DELAY unless the returned timer is cancelled first.
+
+    Cancelling only prevents a filler that hasn't started; one already playing finishes its
+    phrase, and the synthesizer speaks the real reply right after it, so neither is clipped.
+    """
+    if THINKING_FILLER_DELAY <= 0 or client_id not in speech_synthesizers:
+        return None
+    timer = threading.Timer(THINKING_FILLER_DELAY, speak_thinking_filler, args=(client_id,))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+# Avatar video quality profiles, best first. Each profile applies while the median of
+# recent WebRTC stats stays within its limits (rtt/jitter in ms, loss/drop as ratios).
+# The real-time avatar API exposes the video bitrate but not the output resolution.
+AVATAR_QUALITY_PROFILES = [
+    {'name': 'high', 'bitrate': 2000000, 'limits': {'rtt': 100, 'packetLoss': 0.01, 'jitter': 20, 'framesDropped': 0.02}},
+    {'name': 'standard', 'bitrate': 1000000, 'limits': {'rtt': 200, 'packetLoss': 0.03, 'jitter': 40, 'framesDropped': 0.05}},
+    {'name': 'low', 'bitrate': 500000, 'limits': {'rtt': 400, 'packetLoss': 0.08, 'jitter': 80, 'framesDropped': 0.15}},
+    {'name': 'minimal', 'bitrate': 250000, 'limits': {}},
+]
+AVATAR_PROFILE_NAMES = [profile['name'] for profile in AVATAR_QUALITY_PROFILES]
+DEFAULT_AVATAR_PROFILE = 'standard'
+STATS_WINDOW = 300  # Only stats from the last 5 minutes drive profile selection
+STEP_DOWN_SAMPLES = 3  # Consecutive degraded reports before offering a step-down
+STEP_DOWN_INTERVAL = 60  # Minimum seconds between step-downs for a client
+
+# WebRTC stats reported by clients, kept per client, per client network and per Speech region
+avatar_client_stats = {}
+avatar_network_stats = {}
+avatar_region_stats = {}
+avatar_quality_profiles = {}  # client_id -> {'profile': name, 'since': timestamp}
+avatar_stats_lock = threading.Lock()
+avatar_stats_pruned = 0
+
+def prune_avatar_stats():
+    """Drop clients and networks with no stats inside STATS_WINDOW; call with avatar_stats_lock held."""
+    global avatar_stats_pruned
+    now = time.time()
+    if now - avatar_stats_pruned < STATS_WINDOW:
+        return
+    avatar_stats_pruned = now
+    for stats in (avatar_client_stats, avatar_network_stats):
+        for key in [key for key, samples in stats.items() if not samples or samples[-1]['ts'] < now - STATS_WINDOW]:
+            del stats[key]
+
+def client_network_key():
+    """Identify the requesting client's network as its IPv4 /24 or IPv6 /64 prefix.
+
+    X-Forwarded-For is only honored through ProxyFix, for TRUSTED_PROXY_COUNT proxies.
+    """
+    address = request.remote_addr or ''
+    if ':' in address:
+        return ':'.join(address.split(':')[:4])
+    return '.'.join(address.split('.')[:3])
+
+def choose_quality_profile(samples):
+    """Return the best profile whose limits hold for the median of the samples, or None."""
+    if not samples:
+        return None
+    medians = {}
+    for metric in ('rtt', 'packetLoss', 'jitter', 'framesDropped'):
+        values = sorted(sample[metric] for sample in samples if metric in sample)
+        if values:
+            medians[metric] = values[len(values) // 2]
+    for profile in AVATAR_QUALITY_PROFILES:
+        if all(medians.get(metric, 0) <= limit for metric, limit in profile['limits'].items()):
+            return profile['name']
+    return AVATAR_QUALITY_PROFILES[-1]['name']
+
+def recent_samples(samples, since=0):
+    cutoff = max(since, time.time() - STATS_WINDOW)
+    return [sample for sample in samples if sample['ts'] >= cutoff]
+
+def starting_quality_profile(client_id, requested=None):
+    """Pick the starting profile from the request, then the client's or its network's recent stats."""
+    if requested in AVATAR_PROFILE_NAMES:
+        return requested
+    with avatar_stats_lock:
+        client_samples = recent_samples(avatar_client_stats.get(client_id, []))
+        network_samples = recent_samples(avatar_network_stats.get(client_network_key(), []))
+    if client_samples:
+        return choose_quality_profile(client_samples)
+    if len(network_samples) >= STEP_DOWN_SAMPLES:
+        return choose_quality_profile(network_samples)
+    return DEFAULT_AVATAR_PROFILE if DEFAULT_AVATAR_PROFILE in AVATAR_PROFILE_NAMES else 'standard'
+
+@bp.route("/api/avatarStats", methods=["POST"])
+@csrf.exempt  # Exempt this endpoint from CSRF protection
+def report_avatar_stats():
+    """Record the client's WebRTC stats and offer a step-down when quality degrades"""
+    client_id = request.headers.get('ClientId', session.get('client_id', 'default_client'))
+    data = request.get_json(silent=True) or {}
+    sample = {metric: float(data[metric]) for metric in ('rtt', 'packetLoss', 'jitter', 'framesDropped')
+              if isinstance(data.get(metric), (int, float))}
+    if not sample:
+        return jsonify({'error': 'No stats provided'}), 400
+    sample['ts'] = time.time()
+
+    with avatar_stats_lock:
+        prune_avatar_stats()
+        avatar_client_stats.setdefault(client_id, deque(maxlen=30)).append(sample)
+        avatar_network_stats.setdefault(client_network_key(), deque(maxlen=200)).append(sample)
+        avatar_region_stats.setdefault(avatar_regions.get(client_id, speech_region), deque(maxlen=1000)).append(sample)
+        current = avatar_quality_profiles.get(client_id)
+        session_samples = recent_samples(avatar_client_stats[client_id], current['since'] if current else 0)
+
+    if not current:
+        return jsonify({'profile': None, 'action': None})
+
+    # Step down one profile at a time, only after several consecutive degraded reports
+    current_index = AVATAR_PROFILE_NAMES.index(current['profile'])
+    last_samples = session_samples[-STEP_DOWN_SAMPLES:]
+    degraded = len(last_samples) == STEP_DOWN_SAMPLES and all(
+        AVATAR_PROFILE_NAMES.index(choose_quality_profile([s])) > current_index for s in last_samples)
+    if degraded and current_index < len(AVATAR_PROFILE_NAMES) - 1 and time.time() - current['since'] >= STEP_DOWN_INTERVAL:
+        profile = AVATAR_PROFILE_NAMES[current_index + 1]
+        logger.info(f"Offering avatar quality step-down for client {client_id}: {current['profile']} -> {profile}")
+        return jsonify({'profile': current['profile'], 'action': 'step_down', 'target': profile})
+
+    # Below the lowest profile, a network that still can't carry video is offered audio only
+    too_poor = len(last_samples) == STEP_DOWN_SAMPLES and all(
+        any(s.get(metric, 0) > limit for metric, limit in AUDIO_ONLY_LIMITS.items()) for s in last_samples)
+    if too_poor and current_index == len(AVATAR_PROFILE_NAMES) - 1 and time.time() - current['since'] >= STEP_DOWN_INTERVAL:
+        logger.info(f"Offering audio-only mode for client {client_id} on a poor network")
+        return jsonify({'profile': current['profile'], 'action': 'audio_only'})
+    return jsonify({'profile': current['profile'], 'action': None})
+
+# Audio-only degraded mode: when avatar capacity is exhausted, or the client's network can't
+# carry even the lowest video profile, bot replies are synthesized without the talking avatar
+# and streamed to the browser as compressed audio. Capacity-degraded clients are told over
+# their event stream when an avatar slot frees up or the service's retry window passes, so
+# they can switch back to video.
+AVATAR_MAX_SESSIONS = 0  # Concurrent avatar sessions this server allows; 0 means no local limit
+AVATAR_CAPACITY_RETRY = 60  # Seconds to treat avatar capacity as exhausted after the service refuses a session
+AUDIO_ONLY_FORMAT = 'Audio24Khz48KBitRateMonoMp3'
+AUDIO_ONLY_LIMITS = {'rtt': 800, 'packetLoss': 0.15, 'jitter': 150, 'framesDropped': 0.3}
+AUDIO_CHUNK_SIZE = 4096
+PENDING_AUDIO_TTL = 60  # Seconds a synthesized reply waits for the browser to fetch its audio
+# Transient avatar throttling only: subscription quota errors would fail the audio path the same way
+CAPACITY_ERROR_PATTERN = re.compile(r'\b4?429\b|too many requests|throttl|capacity', re.IGNORECASE)
+
+audio_synthesizers = {}  # client_id -> SpeechSynthesizer without the talking avatar
+audio_sessions = {}  # client_id -> {'reason': 'capacity' | 'network', 'region', 'since', 'notified_at'}
+pending_audio_streams = {}  # result_id -> (AudioDataStream, created timestamp)
+avatar_capacity_exhausted_until = 0
+avatar_capacity_timer = None  # Announces capacity to audio-only clients when the retry window passes
+audio_only_stats = {'sessions': {'capacity': 0, 'network': 0}, 'capacity_rejections': 0,
+                    'switched_back': 0, 'utterances': 0, 'audio_bytes': 0}
+audio_only_lock = threading.Lock()
+
+def avatar_capacity_available(client_id):
+    """Whether a new avatar session for the client fits the local limit and the service isn't refusing them."""
+    if time.time() < avatar_capacity_exhausted_until:
+        return False
+    other_sessions = sum(1 for other in avatar_connections if other != client_id)
+    return not AVATAR_MAX_SESSIONS or other_sessions < AVATAR_MAX_SESSIONS
+
+def mark_avatar_capacity_exhausted():
+    """Stop asking the service for avatar sessions for AVATAR_CAPACITY_RETRY seconds, then tell waiting clients."""
+    global avatar_capacity_exhausted_until, avatar_capacity_timer
+    avatar_capacity_exhausted_until = time.time() + AVATAR_CAPACITY_RETRY
+    with audio_only_lock:
+        if avatar_capacity_timer:
+            avatar_capacity_timer.cancel()
+        avatar_capacity_timer = threading.Timer(AVATAR_CAPACITY_RETRY, notify_avatar_available)
+        avatar_capacity_timer.daemon = True
+        avatar_capacity_timer.start()
+
+def avatar_unavailable_response(reason):
+    """Tell the browser to fall back to audio only."""
+    with audio_only_lock:
+        audio_only_stats['capacity_rejections'] += 1
+    response = Response(f"Avatar unavailable: {reason}", status=503)
+    response.headers['AvatarUnavailable'] = reason
+    response.headers['Retry-After'] = str(AVATAR_CAPACITY_RETRY)
+    return response
+
+def notify_avatar_available(client_ids=None):
+    """Tell capacity-degraded audio-only clients that they can switch back to video."""
+    now = time.time()
+    with audio_only_lock:
+        candidates = [client_id for client_id, audio_session in audio_sessions.items()
+                      if audio_session['reason'] == 'capacity' and now - audio_session['notified_at'] >= AVATAR_CAPACITY_RETRY
+                      and (client_ids is None or client_id in client_ids)]
+    for client_id in candidates:
+        if avatar_capacity_available(client_id):
+            with audio_only_lock:
+                if client_id in audio_sessions:
+                    audio_sessions[client_id]['notified_at'] = now
+            publish_speech_event(client_id, 'avatarAvailable', {})
+
+def end_audio_session(client_id):
+    """Drop the client's audio-only synthesizer; returns the session it had, if any."""
+    audio_synthesizers.pop(client_id, None)
+    with audio_only_lock:
+        return audio_sessions.pop(client_id, None)
+
+def audio_only_mimetype():
+    if AUDIO_ONLY_FORMAT.startswith('Ogg'):
+        return 'audio/ogg'
+    if AUDIO_ONLY_FORMAT.startswith('Webm'):
+        return 'audio/webm'
+    return 'audio/mpeg'
+
+@bp.route("/api/connectAudio", methods=["POST"])
+@csrf.exempt  # Exempt this endpoint from CSRF protection
+def connect_audio():
+    """Start an audio-only session, used when no avatar video is available"""
+    try:
+        client_id = request.headers.get('ClientId', session.get('client_id', 'default_client'))
+        voice_name = request.headers.get('TtsVoice', "en-US-JennyNeural")
+        reason = 'network' if request.headers.get('AudioOnlyReason') == 'network' else 'capacity'
+        region = select_speech_region()
+
+        speech_config = speechsdk.SpeechConfig(
+            subscription=speech_region_key(region),
+            endpoint=SPEECH_TTS_URL.format(region=region)
+        )
+        speech_config.speech_synthesis_voice_name = voice_name
+        speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, AUDIO_ONLY_FORMAT))
+        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+        # Open the websocket now so the first reply doesn't pay for the handshake
+        speechsdk.Connection.from_speech_synthesizer(speech_synthesizer).open(True)
+
+        audio_synthesizers[client_id] = speech_synthesizer
+        avatar_voices[client_id] = voice_name
+        with audio_only_lock:
+            audio_sessions[client_id] = {'reason': reason, 'region': region, 'since': time.time(), 'notified_at': 0}
+            audio_only_stats['sessions'][reason] += 1
+        logger.info(f"Audio-only session started for client {client_id} in region {region} ({reason})")
+        return Response("Audio-only session started", status=200)
+    except Exception as e:
+        logger.error(f"Error starting audio-only session: {str(e)}")
+        return Response(f"Error starting audio-only session: {str(e)}", status=500)
+
+def speak_audio_only(client_id, speech_synthesizer, ssml):
+    """Start synthesizing the SSML and hand the browser a URL streaming the compressed audio."""
+    with traffic_capture.span('speech.speak_audio', client_id=client_id, ssml=ssml) as event:
+        result = speech_synthesizer.start_speaking_ssml_async(ssml).get()
+        event['reason'] = str(result.reason)
+        event['result_id'] = result.result_id
+
+    if result.reason == speechsdk.ResultReason.Canceled:
+        cancellation_details = result.cancellation_details
+        logger.error(f"Audio-only synthesis canceled for client {client_id}: {cancellation_details.error_details}")
+        return Response(f"Error speaking: {cancellation_details.error_details}", status=400)
+
+    now = time.time()
+    with audio_only_lock:
+        for result_id, (_, created) in list(pending_audio_streams.items()):
+            if now - created > PENDING_AUDIO_TTL:
+                del pending_audio_streams[result_id]
+        pending_audio_streams[result.result_id] = (speechsdk.AudioDataStream(result), now)
+        audio_only_stats['utterances'] += 1
+
+    # Between turns is a good moment to move back to video if capacity has freed up
+    notify_avatar_available([client_id])
+
+    response = Response(result.result_id, status=200)
+    response.headers['AudioUrl'] = f"/api/speechAudio/{result.result_id}"
+    return response
+
+@bp.route("/api/speechAudio/<result_id>", methods=["GET"])
+def speech_audio(result_id):
+    """Stream the compressed audio of an audio-only reply while it is being synthesized"""
+    with audio_only_lock:
+        audio_stream, _ = pending_audio_streams.pop(result_id, (None, None))
+    if audio_stream is None:
+        return Response("Audio not found", status=404)
+
+    def stream():
+        buffer = bytes(AUDIO_CHUNK_SIZE)
+        total = 0
+        while True:
+            filled = audio_stream.read_data(buffer)
+            if filled == 0:
+                break
+            total += filled
+            yield bytes(buffer[:filled])
+        with audio_only_lock:
+            audio_only_stats['audio_bytes'] += total
+
+    response = Response(stream(), mimetype=audio_only_mimetype())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # The API route to connect to the avatar service
-@app.route("/api/connectAvatar", methods=["POST"])
+@bp.route("/api/connectAvatar", methods=["POST"])
 @csrf.exempt  # Exempt this endpoint from CSRF protection
 def connect_avatar():
     """Connect to the avatar service"""
@@ -550,6 +1606,12 @@ def connect_avatar():
         logger.debug(f"Avatar params - ClientId: {client_id}, Voice: {voice_name}, Style: {style}, Character: {avatar_character}, IsCustom: {is_custom}")
         
         connection_id = client_id  # Use client_id as the connection identifier
+        if not avatar_capacity_available(client_id):
+            logger.info(f"Avatar capacity exhausted, client {client_id} falls back to audio only")
+            return avatar_unavailable_response('capacity')
+        quality_profile = starting_quality_profile(client_id, request.headers.get('QualityProfile'))
+        bitrate = AVATAR_QUALITY_PROFILES[AVATAR_PROFILE_NAMES.index(quality_profile)]['bitrate']
+        logger.debug(f"Avatar quality profile for client {client_id}: {quality_profile} ({bitrate} bps)")
         
         # Wait for the global ice_token to be available if needed
         retry_count = 0
@@ -571,22 +1633,6 @@ def connect_avatar():
             logger.error(f"Raw ICE token (first 100 chars): {ice_token[:100]}")
             return Response(f"Error parsing ICE token: {str(e)}", status=500)
         
-        # Using a global Speech Config ensures we reuse the connection
-        logger.debug(f"Creating speech config with region: {speech_region}")
-        speech_config = speechsdk.SpeechConfig(
-            subscription=speech_key, 
-            endpoint=f'wss://{speech_region}.tts.speech.microsoft.com/cognitiveservices/websocket/v1?enableTalkingAvatar=true'
-        )
-        speech_config.speech_synthesis_voice_name = voice_name
-        
-        # Create speech synthesizer
-        logger.debug("Creating speech synthesizer")
-        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-        
-        # Set up connection to avatar service
-        logger.debug("Setting up connection to avatar service")
-        connection = speechsdk.Connection.from_speech_synthesizer(speech_synthesizer)
-        
         # Create avatar config with WebRTC settings
         logger.debug("Creating avatar config")
         avatar_config = {
@@ -604,7 +1650,7 @@ def connect_avatar():
                         },
                     },
                     'format': {
-                        'bitrate': 1000000
+                        'bitrate': bitrate
                     },
                     'talkingAvatar': {
                         'customized': is_custom,
@@ -618,25 +1664,53 @@ def connect_avatar():
             }
         }
         
-        # Set the avatar configuration
-        logger.debug("Setting avatar configuration")
-        connection.set_message_property('speech.config', 'context', json.dumps(avatar_config))
-        
-        # Store connection and synthesizer in dictionaries using client_id
-        avatar_connections[client_id] = connection
-        speech_synthesizers[client_id] = speech_synthesizer
+        # Try the healthiest regions in turn, starting with the one the client's ICE token came
+        # from if it is still healthy, so new sessions fail over automatically
+        regions = ranked_speech_regions() or [speech_region]
+        client_region = request.headers.get('SpeechRegion')
+        if client_region in regions and is_speech_region_healthy(client_region):
+            regions.remove(client_region)
+            regions.insert(0, client_region)
         
-        # Initialize the connection with an empty speak
-        logger.debug("Initializing the connection with an empty speak")
-        result = speech_synthesizer.speak_text_async('').get()
-        logger.debug(f"Initial speak result reason: {result.reason}")
+        for region in regions[:MAX_CONNECT_REGIONS]:
+            region_ice_token = speech_region_ice_token(region)
+            if region_ice_token:
+                region_ice_token_obj = json.loads(region_ice_token)
+                avatar_config['synthesis']['video']['protocol']['webrtcConfig']['iceServers'] = [{
+                    'urls': [ region_ice_token_obj['Urls'][0] ],
+                    'username': region_ice_token_obj['Username'],
+                    'credential': region_ice_token_obj['Password']
+                }]
+            speech_synthesizer, connection, result = create_avatar_session(region, client_id, voice_name, avatar_config)
+            if result.reason != speechsdk.ResultReason.Canceled:
+                break
+            logger.warning(f"Avatar connection failed in region {region}: {result.cancellation_details.error_details}")
+            connection.close()
+            # A rejected request or exhausted capacity would fail the same way in the next region
+            if not is_region_failure(result):
+                break
         
         if result.reason == speechsdk.ResultReason.Canceled:
             cancellation_details = result.cancellation_details
             logger.error(f"Speech synthesis canceled: {cancellation_details.reason}")
             logger.error(f"Error details: {cancellation_details.error_details}")
+            if CAPACITY_ERROR_PATTERN.search(cancellation_details.error_details or ''):
+                mark_avatar_capacity_exhausted()
+                return avatar_unavailable_response('capacity')
             return Response(f"Error connecting to avatar: {cancellation_details.error_details}", status=400)
         
+        # Store connection and synthesizer in dictionaries using client_id
+        subscribe_speech_events(client_id, speech_synthesizer)
+        avatar_connections[client_id] = connection
+        speech_synthesizers[client_id] = speech_synthesizer
+        avatar_voices[client_id] = voice_name
+        avatar_regions[client_id] = region
+        record_avatar_connected(client_id)
+        if end_audio_session(client_id):
+            with audio_only_lock:
+                audio_only_stats['switched_back'] += 1
+            logger.info(f"Client {client_id} switched back from audio only to avatar video")
+        
         # Get the remote SDP for WebRTC
         logger.debug("Getting remote SDP for WebRTC")
         try:
@@ -715,16 +1789,21 @@ def connect_avatar():
         # Connection is now tracked by client_id instead of session
         logger.debug(f"Avatar connection established for client ID: {client_id}")
         
+        with avatar_stats_lock:
+            avatar_quality_profiles[client_id] = {'profile': quality_profile, 'since': time.time()}
+        
         # Return the remote SDP
         logger.debug("Returning remote SDP to client")
-        return Response(remote_sdp, status=200)
+        response = Response(remote_sdp, status=200)
+        response.headers['AvatarQualityProfile'] = quality_profile
+        return response
     except Exception as e:
         logger.error(f"Error connecting to avatar: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         return Response(f"Error connecting to avatar: {str(e)}", status=500)
 
 # The API route to speak through the avatar
-@app.route("/api/speak", methods=["POST"])
+@bp.route("/api/speak", methods=["POST"])
 @csrf.exempt  # Exempt this endpoint from CSRF protection
 def speak():
     """Speak through the avatar"""
@@ -732,18 +1811,25 @@ def speak():
         # Get client ID from headers
         client_id = request.headers.get('ClientId', session.get('client_id', 'default_client'))
         
+        # Get the SSML to speak
+        ssml = request.data.decode('utf-8')
+        logger.debug(f"Speaking SSML for client {client_id}: {ssml[:100]}...")
+        
+        audio_synthesizer = audio_synthesizers.get(client_id)
+        if audio_synthesizer:
+            return speak_audio_only(client_id, audio_synthesizer, ssml)
+        
         # Get the speech synthesizer from the dictionary using client_id
         speech_synthesizer = speech_synthesizers.get(client_id)
         if not speech_synthesizer:
             logger.error(f"Speech synthesizer not found for client ID: {client_id}")
             return Response("Speech synthesizer not found", status=400)
         
-        # Get the SSML to speak
-        ssml = request.data.decode('utf-8')
-        logger.debug(f"Speaking SSML for client {client_id}: {ssml[:100]}...")
-        
         # Speak the SSML
-        result = speech_synthesizer.speak_ssml_async(ssml).get()
+        with traffic_capture.span('speech.speak', client_id=client_id, ssml=ssml) as event:
+            result = speech_synthesizer.speak_ssml_async(ssml).get()
+            event['reason'] = str(result.reason)
+            event['result_id'] = result.result_id
         
         if result.reason == speechsdk.ResultReason.Canceled:
             cancellation_details = result.cancellation_details
@@ -758,7 +1844,7 @@ def speak():
         return Response(f"Error speaking: {str(e)}", status=500)
 
 # The API route to stop speaking
-@app.route("/api/stopSpeaking", methods=["POST"])
+@bp.route("/api/stopSpeaking", methods=["POST"])
 @csrf.exempt  # Exempt this endpoint from CSRF protection
 def stop_speaking():
     """Stop the avatar from speaking"""
@@ -766,6 +1852,12 @@ def stop_speaking():
         # Get client ID from headers
         client_id = request.headers.get('ClientId', session.get('client_id', 'default_client'))
         
+        audio_synthesizer = audio_synthesizers.get(client_id)
+        if audio_synthesizer:
+            audio_synthesizer.stop_speaking_async().get()
+            logger.debug(f"Audio-only speech stopped for client {client_id}")
+            return Response("Speaking stopped", status=200)
+        
         # Get the connection from the dictionary using client_id
         connection = avatar_connections.get(client_id)
         if not connection:
@@ -784,7 +1876,7 @@ def stop_speaking():
         return Response(f"Error stopping speech: {str(e)}", status=500)
 
 # The API route to disconnect from the avatar service
-@app.route("/api/disconnectAvatar", methods=["POST"])
+@bp.route("/api/disconnectAvatar", methods=["POST"])
 @csrf.exempt  # Exempt this endpoint from CSRF protection
 def disconnect_avatar():
     """Disconnect from the avatar service"""
@@ -792,19 +1884,27 @@ def disconnect_avatar():
         # Get client ID from headers
         client_id = request.headers.get('ClientId', session.get('client_id', 'default_client'))
         
-        # Get the connection from the dictionary using client_id
-        connection = avatar_connections.get(client_id)
+        # Remove the connection before closing it so the health monitor doesn't treat it as a drop
+        connection = avatar_connections.pop(client_id, None)
         if connection:
             logger.debug(f"Closing avatar connection for client {client_id}")
             connection.close()
-            
-        # Remove the connection and synthesizer from dictionaries
-        if client_id in avatar_connections:
-            del avatar_connections[client_id]
             logger.debug(f"Removed avatar connection for client {client_id}")
+            
+        # Remove the synthesizer from the dictionary
         if client_id in speech_synthesizers:
             del speech_synthesizers[client_id]
             logger.debug(f"Removed speech synthesizer for client {client_id}")
+        avatar_voices.pop(client_id, None)
+        avatar_regions.pop(client_id, None)
+        filler_rotation.pop(client_id, None)
+        with avatar_stats_lock:
+            avatar_quality_profiles.pop(client_id, None)
+        with avatar_health_lock:
+            avatar_health.pop(client_id, None)
+        end_audio_session(client_id)
+        if connection:
+            notify_avatar_available()  # An avatar slot has freed up
         
         logger.debug(f"Avatar disconnected successfully for client {client_id}")
         return Response("Disconnected", status=200)
@@ -824,13 +1924,12 @@ class BufferHandler(logging.Handler):
         if len(log_buffer) > 1000:  # Limit to 1000 entries
             log_buffer.pop(0)
 
-# Add the buffer handler to the logger
+# The buffer handler is added to the logger by create_app()
 buffer_handler = BufferHandler()
 buffer_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(buffer_handler)
 
 # Debug endpoint to view logs
-@app.route("/debug/logs")
+@bp.route("/debug/logs")
 def view_logs():
     """View the server logs through the browser"""
     return Response("<pre>" + "\n".join(log_buffer) + "</pre>", 
@@ -838,7 +1937,7 @@ def view_logs():
                    mimetype="text/html")
 
 # Debug endpoint to view the ICE token
-@app.route("/debug/ice-token")
+@bp.route("/debug/ice-token")
 def view_ice_token():
     """View the current ICE token status for debugging"""
     global ice_token
@@ -862,7 +1961,80 @@ def view_ice_token():
             "raw_token": ice_token[:200] + "..." if ice_token and len(ice_token) > 200 else ice_token
         })
 
-@app.route('/api/check-env', methods=['GET'])
+# Debug endpoint to view startup stage timings
+@bp.route("/debug/startup")
+def view_startup_timings():
+    """View how long each startup stage took in this process"""
+    return jsonify({'pid': os.getpid(), 'stages_ms': startup_timings})
+
+# Debug endpoint to view the DirectLine rate-limit governor
+@bp.route("/debug/directline")
+def view_directline_governor():
+    """View DirectLine call, deferral and throttling counters"""
+    return jsonify(directline_governor.status())
+
+# Debug endpoint to view Speech region health
+@bp.route("/debug/speech-regions")
+def view_speech_regions():
+    """View the measured health of every configured Speech region"""
+    with speech_regions_lock:
+        regions = {region: {
+            'latency_ms': round(state['latency_ms'], 1) if state['latency_ms'] is not None else None,
+            'error_rate': round(state['error_rate'], 3),
+            'consecutive_failures': state['failures'],
+            'last_probe': datetime.fromtimestamp(state['last_probe']).isoformat() if state['last_probe'] else None,
+            'token_cached': bool(state['speech_token']),
+            'ice_token_cached': bool(state['ice_token'])
+        } for region, state in speech_regions.items()}
+    return jsonify({
+        'ranking': ranked_speech_regions(),
+        'speech_token_region': speech_token_region,
+        'ice_token_region': ice_token_region,
+        'regions': regions
+    })
+
+# Debug endpoint to view WebRTC stats aggregated per Speech region
+@bp.route("/debug/avatar-stats")
+def view_avatar_stats():
+    """View aggregated avatar WebRTC stats and active quality profiles per region"""
+    with avatar_stats_lock:
+        regions = {}
+        for region, samples in avatar_region_stats.items():
+            samples = recent_samples(samples)
+            summary = {'samples': len(samples)}
+            for metric in ('rtt', 'packetLoss', 'jitter', 'framesDropped'):
+                values = sorted(sample[metric] for sample in samples if metric in sample)
+                if values:
+                    summary[metric] = {'p50': values[len(values) // 2], 'p95': values[int(len(values) * 0.95)]}
+            summary['recommended_profile'] = choose_quality_profile(samples)
+            regions[region or 'unknown'] = summary
+        active_profiles = {}
+        for entry in avatar_quality_profiles.values():
+            active_profiles[entry['profile']] = active_profiles.get(entry['profile'], 0) + 1
+    return jsonify({'regions': regions, 'active_profiles': active_profiles})
+
+@bp.route("/debug/audio-only")
+def view_audio_only():
+    """View audio-only mode usage and current avatar capacity"""
+    with audio_only_lock:
+        active = {}
+        for audio_session in audio_sessions.values():
+            active[audio_session['reason']] = active.get(audio_session['reason'], 0) + 1
+        return jsonify({
+            'active': active,
+            'avatar_sessions': len(avatar_connections),
+            'avatar_max_sessions': AVATAR_MAX_SESSIONS,
+            'capacity_exhausted_for': max(0, round(avatar_capacity_exhausted_until - time.time())),
+            **audio_only_stats
+        })
+
+@bp.route("/debug/avatar-health")
+def view_avatar_health():
+    """View avatar connection health per client and drop/recovery counters"""
+    with avatar_health_lock:
+        return jsonify({'clients': avatar_health, **avatar_health_totals})
+
+@bp.route('/api/check-env', methods=['GET'])
 def check_env():
     """Check if .env file exists and has required variables"""
     env_exists = env_path.exists()
@@ -883,7 +2055,7 @@ def check_env():
         'values': existing_values
     })
 
-@app.route('/api/save-env', methods=['POST'])
+@bp.route('/api/save-env', methods=['POST'])
 def save_env():
     """Save environment variables to .env file"""
     try:
@@ -919,6 +2091,7 @@ SPEECH_KEY={data['speechKey']}"""
         global speech_region, speech_key
         speech_region = os.getenv('SPEECH_REGION')
         speech_key = os.getenv('SPEECH_KEY')
+        configure_speech_regions()
         
         # Restart the ICE token refresh thread
         global ice_token_thread
@@ -946,5 +2119,80 @@ SPEECH_KEY={data['speechKey']}"""
             'message': str(e)
         }), 500
 
+def load_settings():
+    """Read the app's settings from the environment, once .env has been loaded."""
+    global speech_region, speech_key, SPEECH_STS_URL, SPEECH_RELAY_URL, SPEECH_AVATAR_URL, SPEECH_PROBE_INTERVAL
+    global DIRECTLINE_RATE, DIRECTLINE_BURST, directline_governor, transcript_store
+    global THINKING_FILLER_DELAY, DEFAULT_AVATAR_PROFILE, SPEECH_TTS_URL, SPEECH_EVENT_STREAM_MAX_AGE
+    global AVATAR_MAX_SESSIONS, AVATAR_CAPACITY_RETRY, AUDIO_ONLY_FORMAT
+
+    speech_region = os.getenv('SPEECH_REGION')
+    speech_key = os.getenv('SPEECH_KEY')
+    SPEECH_STS_URL = os.getenv('SPEECH_STS_URL', SPEECH_STS_URL)
+    SPEECH_RELAY_URL = os.getenv('SPEECH_RELAY_URL', SPEECH_RELAY_URL)
+    SPEECH_AVATAR_URL = os.getenv('SPEECH_AVATAR_URL', SPEECH_AVATAR_URL)
+    SPEECH_TTS_URL = os.getenv('SPEECH_TTS_URL', SPEECH_TTS_URL)
+    SPEECH_PROBE_INTERVAL = int(os.getenv('SPEECH_PROBE_INTERVAL', SPEECH_PROBE_INTERVAL))
+    configure_speech_regions()
+
+    DIRECTLINE_RATE = float(os.getenv('DIRECTLINE_RATE', DIRECTLINE_RATE))
+    DIRECTLINE_BURST = int(os.getenv('DIRECTLINE_BURST', DIRECTLINE_BURST))
+    directline_governor = DirectLineGovernor(DIRECTLINE_RATE, DIRECTLINE_BURST)
+
+    transcript_store = TranscriptStore(
+        max_entries=int(os.getenv('TRANSCRIPT_MAX_ENTRIES', '200')),
+        max_conversations=int(os.getenv('TRANSCRIPT_MAX_CONVERSATIONS', '500')),
+        max_bytes=int(os.getenv('TRANSCRIPT_MAX_BYTES', str(5 * 1024 * 1024))),
+        max_age=int(os.getenv('TRANSCRIPT_MAX_AGE', str(24 * 3600))),
+        spill_dir=os.getenv('TRANSCRIPT_SPILL_DIR')
+    )
+
+    THINKING_FILLER_DELAY = float(os.getenv('THINKING_FILLER_DELAY', THINKING_FILLER_DELAY))
+    SPEECH_EVENT_STREAM_MAX_AGE = int(os.getenv('SPEECH_EVENT_STREAM_MAX_AGE', SPEECH_EVENT_STREAM_MAX_AGE))
+    if os.getenv('THINKING_FILLER_PHRASES_FILE'):
+        with open(os.getenv('THINKING_FILLER_PHRASES_FILE'), encoding='utf-8') as f:
+            THINKING_FILLER_PHRASES.update(json.load(f))
+    DEFAULT_AVATAR_PROFILE = os.getenv('AVATAR_DEFAULT_QUALITY_PROFILE', DEFAULT_AVATAR_PROFILE)
+    AVATAR_MAX_SESSIONS = int(os.getenv('AVATAR_MAX_SESSIONS', AVATAR_MAX_SESSIONS))
+    AVATAR_CAPACITY_RETRY = int(os.getenv('AVATAR_CAPACITY_RETRY', AVATAR_CAPACITY_RETRY))
+    AUDIO_ONLY_FORMAT = os.getenv('AUDIO_ONLY_FORMAT', AUDIO_ONLY_FORMAT)
+
+    traffic_capture.configure(os.getenv('TRAFFIC_CAPTURE_FILE'))
+
+def create_app():
+    """Create and configure the Flask app.
+
+    Background refreshers start on the first request of each process, and the Speech SDK
+    is imported on first avatar use; both record their startup time like the stages here.
+    """
+    with startup_stage('create_app'):
+        with startup_stage('configure_logging'):
+            logging.basicConfig(level=logging.INFO)
+            if buffer_handler not in logger.handlers:
+                logger.addHandler(buffer_handler)
+
+        with startup_stage('load_env'):
+            load_dotenv(env_path)
+            # Validate required environment variables
+            required_vars = ['DIRECT_LINE_SECRET', 'SPEECH_REGION', 'SPEECH_KEY']
+            missing_vars = [var for var in required_vars if not os.getenv(var)]
+            if missing_vars:
+                logger.error(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+        with startup_stage('load_settings'):
+            load_settings()
+
+        with startup_stage('create_flask_app'):
+            app = Flask(__name__)
+            app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-development-secret-key-here')  # Fallback for development
+            csrf.init_app(app)
+            # Behind a reverse proxy, take the client address from the proxies' X-Forwarded-For
+            trusted_proxies = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+            if trusted_proxies:
+                app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+            app.register_blueprint(bp)
+            app.before_request(start_background_tasks)
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
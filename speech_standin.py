@@ -0,0 +1,132 @@
+"""Local stand-in for the per-region Speech endpoints, for testing region failover without Azure.
+
+Serves the token (STS) and relay (ICE) endpoints of any number of regions on one port, with
+the region as the first path segment, matching the endpoint templates in .env.example:
+
+    python speech_standin.py --port 8081 --down westus2 --delay eastus=300
+
+Regions passed with --down answer 503; --delay adds latency to a region's responses. Regions
+can be taken down and brought back while the app runs:
+
+    curl -X POST http://localhost:8081/westus2/down
+    curl -X POST http://localhost:8081/westus2/up
+
+The stand-in cannot host avatar or TTS sessions: it refuses websocket connections, so the
+Speech SDK reports a connection failure, which counts against the region like an outage.
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+ICE_TOKEN = {'Urls': ['turn:localhost:3478'], 'Username': 'standin', 'Password': 'standin'}
+
+
+class StandinState:
+    """Which regions are down and how much latency each adds, shared by all request threads."""
+
+    def __init__(self, down=(), delays=None):
+        self.lock = threading.Lock()
+        self.down = set(down)
+        self.delays = dict(delays or {})
+        self.requests = {}  # (region, endpoint) -> count
+
+    def record(self, region, endpoint):
+        with self.lock:
+            self.requests[(region, endpoint)] = self.requests.get((region, endpoint), 0) + 1
+            return region not in self.down, self.delays.get(region, 0)
+
+    def set_down(self, region, down):
+        with self.lock:
+            if down:
+                self.down.add(region)
+            else:
+                self.down.discard(region)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    state = None  # Set by make_server()
+
+    def do_POST(self):
+        region, _, endpoint = self.path.lstrip('/').partition('/')
+        if endpoint in ('down', 'up'):
+            self.state.set_down(region, endpoint == 'down')
+            logger.info(f"Region {region} is now {endpoint}")
+            return self.reply(200, f"{region} {endpoint}")
+        if endpoint.startswith('sts/v1.0/issueToken'):
+            return self.serve(region, 'sts', lambda: f"standin-token-{region}-{uuid.uuid4().hex}")
+        self.reply(404, 'Not found')
+
+    def do_GET(self):
+        region, _, endpoint = self.path.lstrip('/').partition('/')
+        if endpoint.startswith('avatar/relay/token/v1'):
+            return self.serve(region, 'relay', lambda: json.dumps(ICE_TOKEN))
+        if endpoint.startswith('websocket/v1'):
+            self.state.record(region, 'websocket')
+            # Close without answering the upgrade, so the SDK reports a connection failure
+            self.close_connection = True
+            return
+        if self.path == '/stats':
+            with self.state.lock:
+                stats = {'down': sorted(self.state.down),
+                         'requests': {f"{region} {endpoint}": count
+                                      for (region, endpoint), count in self.state.requests.items()}}
+            return self.reply(200, json.dumps(stats), 'application/json')
+        self.reply(404, 'Not found')
+
+    def serve(self, region, endpoint, body):
+        up, delay_ms = self.state.record(region, endpoint)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        if not up:
+            return self.reply(503, f"Region {region} is down")
+        self.reply(200, body())
+
+    def reply(self, status, body, content_type='text/plain'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def make_server(port=8081, down=(), delays=None):
+    handler = type('BoundStandinHandler', (StandinHandler,), {'state': StandinState(down, delays)})
+    return ThreadingHTTPServer(('localhost', port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--down', action='append', default=[], metavar='REGION', help='Region that answers 503')
+    parser.add_argument('--delay', action='append', default=[], metavar='REGION=MS', help='Latency added to a region')
+    args = parser.parse_args(argv)
+
+    delays = {}
+    for entry in args.delay:
+        region, _, ms = entry.partition('=')
+        delays[region] = float(ms)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    server = make_server(args.port, args.down, delays)
+    logger.info(f"Speech stand-in listening on http://localhost:{args.port} (down: {', '.join(args.down) or 'none'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -20,7 +20,10 @@ let isFirstRecognizingEvent = true;
 // Variables for the new Speech SDK approach
 let clientId;
 let lastInteractionTime = new Date();
+const AVATAR_IDLE_RECONNECT_MS = 5 * 60 * 1000; // Dropped avatar sessions idle this long aren't reconnected
 let userClosedSession = false;
+let transcriptCursor = 0; // Last transcript entry shown, for incremental restore
+const TRANSCRIPT_PAGE_SIZE = 50;
 
 // Update microphone status
 function updateMicStatus(message, isError = false) {
@@ -41,11 +44,52 @@ function initializeClientId() {
     }
 }
 
+// The browser Speech SDK is only needed for the microphone, so it is loaded on first use
+// (or warmed up when an avatar session starts) instead of blocking page load
+const SPEECH_SDK_URL = 'https://cdn.jsdelivr.net/npm/microsoft-cognitiveservices-speech-sdk@latest/distrib/browser/microsoft.cognitiveservices.speech.sdk.bundle-min.js';
+let speechSdkPromise;
+
+// Load the Speech SDK once; resolves with window.SpeechSDK
+function loadSpeechSDK() {
+    if (window.SpeechSDK) {
+        return Promise.resolve(window.SpeechSDK);
+    }
+    if (!speechSdkPromise) {
+        const statusElement = document.getElementById('micStatus');
+        const previousStatus = statusElement.textContent;
+        updateMicStatus('Loading Speech SDK...');
+        speechSdkPromise = new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = SPEECH_SDK_URL;
+            script.async = true;
+            const fail = message => {
+                speechSdkPromise = undefined; // Allow a retry on the next interaction
+                script.remove();
+                reject(new Error(message));
+            };
+            script.onload = () => {
+                if (window.SpeechSDK) {
+                    console.log('Speech SDK loaded successfully');
+                    // Restore the status unless something else has updated it meanwhile
+                    if (statusElement.textContent === 'Loading Speech SDK...') {
+                        updateMicStatus(previousStatus);
+                    }
+                    resolve(window.SpeechSDK);
+                } else {
+                    fail('Speech SDK loaded but SpeechSDK is not defined');
+                }
+            };
+            script.onerror = () => fail('Speech SDK failed to load');
+            document.head.appendChild(script);
+        });
+    }
+    return speechSdkPromise;
+}
+
 // Initialize everything when page loads
 window.onload = () => {
     initializeClientId();
-    // Initialize speech configuration when page loads
-    initializeSpeechConfig();
+    restoreTranscript();
     
     // Fetch ICE token and prepare peer connection on page load
     fetchIceToken(); 
@@ -54,16 +98,12 @@ window.onload = () => {
 
 // Initialize speech configuration
 async function initializeSpeechConfig() {
-    if (!window.SpeechSDK) {
-        updateMicStatus('Waiting for Speech SDK to load...');
-        await new Promise(resolve => {
-            const checkSDK = setInterval(() => {
-                if (window.SpeechSDK) {
-                    clearInterval(checkSDK);
-                    resolve();
-                }
-            }, 100);
-        });
+    try {
+        await loadSpeechSDK();
+    } catch (error) {
+        console.error('Error loading Speech SDK:', error);
+        updateMicStatus(`Error: ${error.message}`, true);
+        return false;
     }
 
     if (!SPEECH_CONFIG.region || !SPEECH_CONFIG.key) {
@@ -234,25 +274,36 @@ async function speakWithAvatar(text) {
 
         if (!response.ok) {
             const errorText = await response.text();
+            if (response.status === 400 && errorText === 'Speech synthesizer not found') {
+                // The server already tore down a dropped session; its avatarDisconnected event was missed
+                isSpeaking = false;
+                handleAvatarDisconnected();
+                return;
+            }
             throw new Error(`HTTP error! status: ${response.status}, message: ${errorText}`);
         }
 
         const result = await response.text();
         console.log("Avatar speech initiated successfully:", result);
 
+        // In audio-only mode the reply is streamed as compressed audio and played here
+        const audioUrl = response.headers.get('AudioUrl');
+        if (audioUrl) {
+            playSpeechAudio(audioUrl);
+            return;
+        }
+
         // Note: The actual speaking happens on the server and is streamed via WebRTC
-        // We don't get immediate feedback when speaking completes, so we'll set a timeout
+        // Without the event stream we don't get feedback when speaking completes, so we'll set a timeout
         // Give minimum 3 seconds for user to potentially stop, then estimate based on text length
         const minSpeakTime = 3000; // 3 seconds minimum
         const estimatedSpeakTime = Math.max(minSpeakTime, text.length * 80); // 80ms per character, minimum 3 seconds
-        
-        setTimeout(() => {
-            if (isSpeaking) { // Only reset speaking flag, keep button enabled for session
-                console.log('Avatar speaking timeout - resetting isSpeaking flag');
-                isSpeaking = false;
-                // Don't disable the button here - it should stay enabled for the session
-            }
-        }, estimatedSpeakTime);
+
+        // The speech event stream reports when speaking really completes; the timeout then only
+        // guards against a completion event lost while the stream was reconnecting
+        armSpeakingTimeout(speechEventsConnected
+            ? estimatedSpeakTime * 2 + SPEECH_EVENT_GRACE_MS
+            : estimatedSpeakTime);
 
     } catch (error) {
         console.error('Error in speakWithAvatar:', error);
@@ -262,6 +313,192 @@ async function speakWithAvatar(text) {
     }
 }
 
+// Speech lifecycle events pushed by the server drive isSpeaking with real timings
+const SPEECH_EVENT_GRACE_MS = 10000;
+let speechEventSource;
+let speechEventsConnected = false;
+let currentSpeechResultId;
+let lastSpokenWord;
+let speakingTimeout;
+
+// Reset isSpeaking if nothing reports the end of the current utterance in time
+function armSpeakingTimeout(delay) {
+    clearTimeout(speakingTimeout);
+    speakingTimeout = setTimeout(() => {
+        if (isSpeaking) { // Only reset speaking flag, keep button enabled for session
+            console.log('Avatar speaking timeout - resetting isSpeaking flag');
+            isSpeaking = false;
+            currentSpeechResultId = undefined;
+            // Don't disable the button here - it should stay enabled for the session
+        }
+    }, delay);
+}
+
+function openSpeechEventStream() {
+    if (speechEventSource) return;
+    speechEventSource = new EventSource(`/api/speechEvents?clientId=${encodeURIComponent(clientId)}`);
+    speechEventSource.onopen = () => {
+        speechEventsConnected = true;
+        console.log('Speech event stream connected');
+    };
+    speechEventSource.onerror = () => {
+        // EventSource reconnects by itself; fall back to estimates until it does
+        speechEventsConnected = false;
+    };
+
+    speechEventSource.addEventListener('started', e => {
+        currentSpeechResultId = JSON.parse(e.data).resultId;
+        lastSpokenWord = undefined;
+        isSpeaking = true;
+    });
+    speechEventSource.addEventListener('wordBoundary', e => {
+        lastSpokenWord = JSON.parse(e.data);
+    });
+    const onSpeechFinished = e => {
+        const data = JSON.parse(e.data);
+        // Ignore a late event for an utterance that has already been superseded
+        if (!currentSpeechResultId || data.resultId === currentSpeechResultId) {
+            console.log(`Avatar finished speaking (${e.type})`);
+            currentSpeechResultId = undefined;
+            isSpeaking = false;
+            clearTimeout(speakingTimeout);
+        }
+    };
+    speechEventSource.addEventListener('completed', onSpeechFinished);
+    speechEventSource.addEventListener('canceled', onSpeechFinished);
+    speechEventSource.addEventListener('avatarDisconnected', handleAvatarDisconnected);
+    speechEventSource.addEventListener('avatarAvailable', () => {
+        pendingAvatarSwitch = true;
+        maybeSwitchBackToAvatar();
+    });
+}
+
+function closeSpeechEventStream() {
+    if (speechEventSource) {
+        speechEventSource.close();
+        speechEventSource = undefined;
+    }
+    speechEventsConnected = false;
+}
+
+// Audio-only mode: when no avatar video is available (capacity exhausted or a network too poor
+// for video), bot replies are streamed from the server as compressed audio and played in order
+let audioOnlyReason; // 'capacity' or 'network' while in audio-only mode
+let pendingAvatarSwitch = false;
+let speechAudioPlayer;
+let speechAudioQueue = [];
+
+async function startAudioOnlySession(reason) {
+    console.log(`Switching to audio-only mode (${reason})`);
+    const response = await fetch('/api/connectAudio', {
+        method: 'POST',
+        headers: {
+            'ClientId': clientId,
+            'TtsVoice': document.getElementById('ttsVoice').value || 'en-US-JennyNeural',
+            'AudioOnlyReason': reason
+        },
+        body: ''
+    });
+    isReconnecting = false;
+    if (!response.ok) {
+        document.getElementById('startAvatarButton').disabled = false;
+        throw new Error(`Failed starting audio-only session: ${response.status} ${response.statusText}`);
+    }
+
+    audioOnlyReason = reason;
+    sessionActive = true;
+    const remoteVideoDiv = document.getElementById('remoteVideo');
+    remoteVideoDiv.querySelectorAll('video, audio').forEach(element => element.remove());
+    remoteVideoDiv.classList.add('audio-only');
+    remoteVideoDiv.style.width = '100%';
+    remoteVideoDiv.style.height = '100%';
+    document.getElementById('microphone').disabled = false;
+    document.getElementById('stopSession').disabled = false;
+    document.getElementById('chatHistory').hidden = false;
+    const stopAvatarButton = document.getElementById('stopAvatarButton');
+    if (stopAvatarButton) {
+        stopAvatarButton.disabled = false;
+    }
+}
+
+// Move a video session to audio only, between turns so speech isn't cut off
+function switchToAudioOnly(reason) {
+    if (isReconnecting || audioOnlyReason) return;
+    pendingAudioOnly = false;
+    isReconnecting = true;
+    stopStatsCollection();
+    sessionActive = false;
+
+    fetch('/api/disconnectAvatar', {
+        method: 'POST',
+        headers: {
+            'ClientId': clientId
+        },
+        body: ''
+    }).finally(() => {
+        if (peerConnection) {
+            peerConnection.close();
+            peerConnection = undefined;
+        }
+        startAudioOnlySession(reason).catch(error => console.error(error));
+    });
+}
+
+function endAudioOnlyMode() {
+    audioOnlyReason = undefined;
+    pendingAvatarSwitch = false;
+    stopSpeechAudio();
+    document.getElementById('remoteVideo').classList.remove('audio-only');
+}
+
+// Try the avatar again once capacity has freed up, between turns
+function maybeSwitchBackToAvatar() {
+    if (!pendingAvatarSwitch || audioOnlyReason !== 'capacity' || isSpeaking || isReconnecting) return;
+    console.log('Avatar capacity available again, switching back to video');
+    pendingAvatarSwitch = false;
+    isReconnecting = true;
+    waitForPeerConnectionAndStartSession();
+}
+
+function playSpeechAudio(url) {
+    if (!speechAudioPlayer) {
+        speechAudioPlayer = new Audio();
+        speechAudioPlayer.onended = playNextSpeechAudio;
+        speechAudioPlayer.onerror = () => {
+            console.error('Error playing audio-only reply');
+            playNextSpeechAudio();
+        };
+    }
+    speechAudioQueue.push(url);
+    if (speechAudioPlayer.paused && speechAudioQueue.length === 1) {
+        playNextSpeechAudio();
+    }
+}
+
+function playNextSpeechAudio() {
+    const url = speechAudioQueue.shift();
+    if (!url) {
+        isSpeaking = false;
+        maybeSwitchBackToAvatar();
+        return;
+    }
+    isSpeaking = true;
+    speechAudioPlayer.src = url;
+    speechAudioPlayer.play().catch(error => {
+        console.error('Error playing audio-only reply:', error);
+        playNextSpeechAudio();
+    });
+}
+
+function stopSpeechAudio() {
+    speechAudioQueue = [];
+    if (speechAudioPlayer) {
+        speechAudioPlayer.pause();
+        speechAudioPlayer.removeAttribute('src');
+    }
+    isSpeaking = false;
+}
+
 // Stop the avatar from speaking
 // Stop the avatar from speaking using server-side API
 async function stopAvatarSpeaking() {
@@ -273,6 +510,10 @@ async function stopAvatarSpeaking() {
         // Get CSRF token
         const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
         
+        if (audioOnlyReason) {
+            stopSpeechAudio();
+        }
+
         // Send stop speaking request to server
         const response = await fetch('/api/stopSpeaking', {
             method: 'POST',
@@ -284,7 +525,7 @@ async function stopAvatarSpeaking() {
         });
 
         if (response.ok) {
-            console.log('Successfully stopped avatar speaking');
+            console.log('Successfully stopped avatar speaking', lastSpokenWord ? `after "${lastSpokenWord.text}"` : '');
             isSpeaking = false;
             // Don't disable the button - session should remain active for new speech
         } else {
@@ -301,6 +542,7 @@ async function stopAvatarSpeaking() {
 // Update the handleChatMessage function to use the avatar for speech
 async function handleChatMessage(message) {
     try {
+        lastInteractionTime = new Date();
         
         // Stop speaking if already speaking
         if (isSpeaking) {
@@ -310,7 +552,7 @@ async function handleChatMessage(message) {
         }
 
         // Display user message on the right side
-        displayMessage(message, 'user', 'right');
+        const userEntry = displayMessage(message, 'user', 'right');
         
         // Show typing indicator
         document.getElementById('typingIndicator').style.display = 'block';
@@ -323,11 +565,17 @@ async function handleChatMessage(message) {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
+                'X-CSRFToken': csrfToken,
+                'ClientId': clientId
             },
             body: JSON.stringify({ message })
         });
 
+        if (response.status === 429) {
+            // DirectLine is throttling; the conversation is intact, so the message can simply be resent
+            const retryAfter = response.headers.get('Retry-After');
+            throw new Error(`The bot is busy, please try again ${retryAfter ? `in ${retryAfter} seconds` : 'shortly'}`);
+        }
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -367,24 +615,11 @@ async function handleChatMessage(message) {
         // Clean up the response text if needed
         botResponse = botResponse.replace(/\\r\\n/g, '\n').trim();
 
-        // Separate the main response from the disclaimer
-        let mainResponse = botResponse;
-        let disclaimer = '';
-        
-        // Check for AI-generated content disclaimer
-        const disclaimerPattern = /(AI-generated content may be incorrect|AI-generated content disclaimer)/i;
-        if (disclaimerPattern.test(botResponse)) {
-            const parts = botResponse.split(disclaimerPattern);
-            mainResponse = parts[0].trim();
-            disclaimer = parts[1] ? parts[1].trim() : '';
-        }
-
-        // Display bot's main response on the left side
-        displayMessage(mainResponse, 'bot', 'left');
-        
-        // Display disclaimer as a footnote if it exists
-        if (disclaimer) {
-            displayMessage(disclaimer, 'disclaimer', 'left');
+        // Display bot's main response on the left side, with any disclaimer as a footnote
+        userEntry.id = data.user_cursor;
+        const mainResponse = displayBotMessage(botResponse, data.cursor);
+        if (data.cursor) {
+            transcriptCursor = data.cursor;
         }
 
         // Hide typing indicator
@@ -405,19 +640,199 @@ async function handleChatMessage(message) {
     }
 }
 
-// Update displayMessage function to handle alignment
-function displayMessage(message, sender, alignment = 'left') {
-    const chatMessages = document.getElementById('chatMessages');
+// Split a bot reply into its main text and any AI-generated content disclaimer
+function splitDisclaimer(botResponse) {
+    let mainResponse = botResponse;
+    let disclaimer = '';
+    
+    // Check for AI-generated content disclaimer
+    const disclaimerPattern = /(AI-generated content may be incorrect|AI-generated content disclaimer)/i;
+    if (disclaimerPattern.test(botResponse)) {
+        const parts = botResponse.split(disclaimerPattern);
+        mainResponse = parts[0].trim();
+        disclaimer = parts[1] ? parts[1].trim() : '';
+    }
+    return [mainResponse, disclaimer];
+}
+
+// Display a bot reply with its disclaimer as a footnote; returns the main text
+function displayBotMessage(botResponse, id) {
+    const [mainResponse, disclaimer] = splitDisclaimer(botResponse);
+    displayMessage(mainResponse, 'bot', 'left', id);
+    if (disclaimer) {
+        displayMessage(disclaimer, 'disclaimer', 'left', id);
+    }
+    return mainResponse;
+}
+
+// Chat history entries for one transcript entry, as displayMessage/displayBotMessage would add them
+function transcriptHistoryEntries(entry) {
+    if (entry.role === 'user') {
+        return [{ message: entry.text, sender: 'user', alignment: 'right', id: entry.id }];
+    }
+    const [mainResponse, disclaimer] = splitDisclaimer(entry.text.replace(/\\r\\n/g, '\n').trim());
+    const entries = [{ message: mainResponse, sender: 'bot', alignment: 'left', id: entry.id }];
+    if (disclaimer) {
+        entries.push({ message: disclaimer, sender: 'disclaimer', alignment: 'left', id: entry.id });
+    }
+    return entries;
+}
+
+// Restore chat history from the server-side transcript after a page reload
+async function restoreTranscript() {
+    try {
+        // Only the newest page; older history isn't needed until the user scrolls back
+        const response = await fetch(`/api/transcript?limit=${TRANSCRIPT_PAGE_SIZE}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        data.messages.forEach(entry => {
+            if (entry.role === 'user') {
+                displayMessage(entry.text, 'user', 'right', entry.id);
+            } else {
+                displayBotMessage(entry.text.replace(/\\r\\n/g, '\n').trim(), entry.id);
+            }
+        });
+        transcriptCursor = data.cursor;
+        transcriptHasOlder = data.has_more;
+    } catch (error) {
+        console.error('Error restoring transcript:', error);
+    }
+}
+
+// Chat history windowing: all messages are kept as plain entries, but only the newest
+// MAX_RENDERED_MESSAGES (plus any older ones the user scrolls back to) are in the DOM
+const MAX_RENDERED_MESSAGES = 100;
+const RENDER_BATCH_SIZE = 50;
+const MAX_HISTORY_ENTRIES = 1000; // Scrolling back past these fetches no further transcript pages
+let chatHistoryEntries = []; // { message, sender, alignment, id }, id being the transcript cursor once known
+let transcriptHasOlder = false; // Whether the server transcript has entries older than chatHistoryEntries
+let loadingOlderTranscript = false;
+let firstRenderedIndex = 0; // Index in chatHistoryEntries of the first message in the DOM
+let stickToBottom = true;
+let scrollFrameRequested = false;
+let hydrateFrameRequested = false;
+
+// Build the DOM node for one chat history entry
+function createMessageElement(entry) {
     const messageDiv = document.createElement('div');
-    messageDiv.className = `message ${sender}-message ${alignment}-aligned`;
+    messageDiv.className = `message ${entry.sender}-message ${entry.alignment}-aligned`;
     
-    if (sender === 'disclaimer') {
+    if (entry.sender === 'disclaimer') {
         messageDiv.className += ' disclaimer';
     }
     
-    messageDiv.textContent = message;
-    chatMessages.appendChild(messageDiv);
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    messageDiv.textContent = entry.message;
+    return messageDiv;
+}
+
+// Update displayMessage function to handle alignment; returns the history entry
+function displayMessage(message, sender, alignment = 'left', id = undefined) {
+    const chatMessages = document.getElementById('chatMessages');
+    const entry = { message, sender, alignment, id };
+    chatHistoryEntries.push(entry);
+
+    if (chatHistoryEntries.length > MAX_HISTORY_ENTRIES) {
+        const removed = dropOldestEntry();
+        // A reply and its disclaimer are one transcript entry; drop both so paging back restores both
+        while (removed.id !== undefined && chatHistoryEntries[0].id === removed.id) {
+            dropOldestEntry();
+        }
+    }
+
+    chatMessages.appendChild(createMessageElement(entry));
+    scheduleScrollUpdate();
+    return entry;
+}
+
+function dropOldestEntry() {
+    const removed = chatHistoryEntries.shift();
+    if (firstRenderedIndex > 0) {
+        firstRenderedIndex--;
+    } else {
+        document.getElementById('chatMessages').firstElementChild?.remove();
+    }
+    if (removed.id !== undefined) {
+        transcriptHasOlder = true;
+    }
+    return removed;
+}
+
+// Trim and scroll to the newest message at most once per animation frame
+function scheduleScrollUpdate() {
+    if (scrollFrameRequested) return;
+    scrollFrameRequested = true;
+    requestAnimationFrame(() => {
+        scrollFrameRequested = false;
+        if (!stickToBottom) return; // Don't yank the user away from history they're reading
+        const chatMessages = document.getElementById('chatMessages');
+        while (chatMessages.childElementCount > MAX_RENDERED_MESSAGES) {
+            chatMessages.firstElementChild.remove();
+            firstRenderedIndex++;
+        }
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    });
+}
+
+// Re-render the batch of entries just above the first rendered message, keeping the view in place
+function hydrateOlderMessages() {
+    if (hydrateFrameRequested) return;
+    if (firstRenderedIndex === 0) {
+        loadOlderTranscript();
+        return;
+    }
+    hydrateFrameRequested = true;
+    requestAnimationFrame(() => {
+        hydrateFrameRequested = false;
+        const chatMessages = document.getElementById('chatMessages');
+        const start = Math.max(0, firstRenderedIndex - RENDER_BATCH_SIZE);
+        const fragment = document.createDocumentFragment();
+        chatHistoryEntries.slice(start, firstRenderedIndex).forEach(entry => {
+            fragment.appendChild(createMessageElement(entry));
+        });
+        const previousHeight = chatMessages.scrollHeight;
+        chatMessages.insertBefore(fragment, chatMessages.firstChild);
+        chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+        firstRenderedIndex = start;
+    });
+}
+
+// Fetch the transcript page before the oldest entry held, once the user has scrolled back to it
+async function loadOlderTranscript() {
+    const oldest = chatHistoryEntries[0];
+    if (!transcriptHasOlder || loadingOlderTranscript || !oldest || oldest.id === undefined ||
+        chatHistoryEntries.length >= MAX_HISTORY_ENTRIES) return;
+
+    loadingOlderTranscript = true;
+    try {
+        const response = await fetch(`/api/transcript?before=${oldest.id}&limit=${TRANSCRIPT_PAGE_SIZE}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        const olderEntries = data.messages.flatMap(transcriptHistoryEntries);
+        transcriptHasOlder = data.has_more;
+        if (chatHistoryEntries[0] !== oldest) return; // History was trimmed meanwhile; the next scroll retries
+        chatHistoryEntries.unshift(...olderEntries);
+        firstRenderedIndex += olderEntries.length;
+        hydrateOlderMessages();
+    } catch (error) {
+        console.error('Error loading older transcript:', error);
+    } finally {
+        loadingOlderTranscript = false;
+    }
+}
+
+// Track whether the user is following the conversation or reading older messages
+function handleChatScroll() {
+    const chatMessages = document.getElementById('chatMessages');
+    stickToBottom = chatMessages.scrollHeight - chatMessages.scrollTop - chatMessages.clientHeight < 50;
+    if (stickToBottom) {
+        scheduleScrollUpdate();
+    } else if (chatMessages.scrollTop < 200) {
+        hydrateOlderMessages();
+    }
 }
 
 // Initialize chat when document is loaded
@@ -427,6 +842,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const messageInput = document.getElementById('messageInput');
     const sendButton = document.getElementById('sendButton');
     
+    document.getElementById('chatMessages').addEventListener('scroll', handleChatScroll, { passive: true });
+    
     messageForm.addEventListener('submit', (e) => {
         e.preventDefault();
         const message = messageInput.value.trim();
@@ -449,6 +866,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const stopMicButton = document.getElementById('stopMicButton');
     
     startMicButton.addEventListener('click', startRecognition);
+    // Start fetching the SDK as soon as the user reaches for the microphone
+    startMicButton.addEventListener('pointerenter', () => loadSpeechSDK().catch(() => {}), { once: true });
     stopMicButton.addEventListener('click', stopRecognition);
 
     // Voice settings handlers
@@ -472,9 +891,9 @@ document.addEventListener('DOMContentLoaded', () => {
 // Connect to avatar service
 // Create speech recognizer
 function createSpeechRecognizer() {
-    fetch('/api/getSpeechToken', {
+    loadSpeechSDK().then(() => fetch('/api/getSpeechToken', {
         method: 'GET',
-    })
+    }))
     .then(response => {
         if (response.ok) {
             const speechRegion = response.headers.get('SpeechRegion');
@@ -586,16 +1005,27 @@ function debugButtonState(context) {
 
 // Global variables for peer connection management (matching Azure sample)
 let iceServerUrl, iceServerUsername, iceServerCredential;
+let iceServerRegion; // Speech region the ICE token was issued for
 let peerConnectionQueue = [];
 let speechSynthesizerConnected = false;
 let isReconnecting = false;
 
+// WebRTC stats reporting for adaptive avatar video quality
+const STATS_INTERVAL_MS = 10000;
+let statsTimer;
+let previousVideoStats;
+let currentQualityProfile;
+let requestedQualityProfile;
+let pendingQualityStepDown;
+let pendingAudioOnly = false;
+
 // Fetch ICE token from the server (matching Azure sample exactly)
 function fetchIceToken() {
     fetch('/api/getIceToken', {
         method: 'GET',
     }).then(response => {
         if (response.ok) {
+            iceServerRegion = response.headers.get('SpeechRegion');
             response.json().then(data => {
                 iceServerUrl = data.Urls[0];
                 iceServerUsername = data.Username;
@@ -694,6 +1124,7 @@ function preparePeerConnection() {
                 isReconnecting = false;
                 setTimeout(() => { 
                     sessionActive = true;
+                    startStatsCollection();
                     // Enable stop avatar button when session becomes active
                     const stopAvatarButton = document.getElementById('stopAvatarButton');
                     if (stopAvatarButton) {
@@ -747,6 +1178,131 @@ function preparePeerConnection() {
     });
 }
 
+// Start reporting WebRTC stats for the active peer connection
+function startStatsCollection() {
+    stopStatsCollection();
+    previousVideoStats = undefined;
+    statsTimer = setInterval(collectAndReportStats, STATS_INTERVAL_MS);
+}
+
+function stopStatsCollection() {
+    if (statsTimer) {
+        clearInterval(statsTimer);
+        statsTimer = undefined;
+    }
+}
+
+// Sample RTT, packet loss, jitter and dropped frames since the last report and post them to the server
+async function collectAndReportStats() {
+    if (!peerConnection || !sessionActive) return;
+
+    try {
+        const report = await peerConnection.getStats();
+        let rtt;
+        let video;
+        report.forEach(stat => {
+            if (stat.type === 'candidate-pair' && stat.nominated && stat.currentRoundTripTime !== undefined) {
+                rtt = stat.currentRoundTripTime * 1000;
+            } else if (stat.type === 'inbound-rtp' && stat.kind === 'video') {
+                video = stat;
+            }
+        });
+        if (!video) return;
+
+        const previous = previousVideoStats || { packetsLost: 0, packetsReceived: 0, framesDropped: 0, framesReceived: 0 };
+        previousVideoStats = video;
+        const lost = (video.packetsLost || 0) - (previous.packetsLost || 0);
+        const received = (video.packetsReceived || 0) - (previous.packetsReceived || 0);
+        const dropped = (video.framesDropped || 0) - (previous.framesDropped || 0);
+        const frames = (video.framesReceived || 0) - (previous.framesReceived || 0);
+
+        const sample = {
+            packetLoss: lost + received > 0 ? Math.max(0, lost) / (lost + received) : 0,
+            jitter: (video.jitter || 0) * 1000,
+            framesDropped: frames > 0 ? Math.max(0, dropped) / frames : 0
+        };
+        if (rtt !== undefined) {
+            sample.rtt = rtt;
+        }
+
+        const response = await fetch('/api/avatarStats', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'ClientId': clientId
+            },
+            body: JSON.stringify(sample)
+        });
+        if (!response.ok) return;
+
+        const result = await response.json();
+        if (result.action === 'step_down') {
+            pendingQualityStepDown = result.target;
+        } else if (result.action === 'audio_only') {
+            pendingAudioOnly = true;
+        }
+        if (pendingAudioOnly && !isSpeaking) {
+            switchToAudioOnly('network');
+        } else if (pendingQualityStepDown && !isSpeaking) {
+            stepDownAvatarQuality(pendingQualityStepDown);
+        }
+    } catch (error) {
+        console.error('Error reporting WebRTC stats:', error);
+    }
+}
+
+// Reconnect the avatar at a lower quality profile, between turns so speech isn't cut off
+function stepDownAvatarQuality(profile) {
+    if (isReconnecting) return;
+    console.log(`Stepping avatar quality down from ${currentQualityProfile} to ${profile}`);
+    pendingQualityStepDown = undefined;
+    requestedQualityProfile = profile;
+    reconnectAvatarSession(true);
+}
+
+// The server saw the avatar connection drop and has already torn it down; renegotiate now
+// with a prepared peer connection instead of waiting for the next speak to fail. An idle
+// session is let go instead, so an unattended page doesn't hold avatar capacity.
+function handleAvatarDisconnected() {
+    if (isReconnecting || userClosedSession) return;
+    if (new Date() - lastInteractionTime >= AVATAR_IDLE_RECONNECT_MS) {
+        console.log('Avatar connection dropped while idle, ending the session');
+        document.getElementById('startAvatarButton').disabled = false;
+        document.getElementById('microphone').disabled = true;
+        document.getElementById('stopSession').disabled = true;
+        if (peerConnection) {
+            peerConnection.close();
+            peerConnection = undefined;
+        }
+        disconnectAvatar();
+        return;
+    }
+    console.log('Avatar connection dropped on the server, reconnecting');
+    requestedQualityProfile = currentQualityProfile;
+    reconnectAvatarSession(false);
+}
+
+// Replace the current avatar session with a new one, optionally closing it on the server first
+function reconnectAvatarSession(disconnectFirst) {
+    isReconnecting = true;
+    stopStatsCollection();
+    sessionActive = false;
+
+    const disconnected = disconnectFirst ? fetch('/api/disconnectAvatar', {
+        method: 'POST',
+        headers: {
+            'ClientId': clientId
+        },
+        body: ''
+    }) : Promise.resolve();
+    disconnected.finally(() => {
+        if (peerConnection) {
+            peerConnection.close();
+        }
+        waitForPeerConnectionAndStartSession();
+    });
+}
+
 // Wait for peer connection and start session (exactly as in Azure sample)
 function waitForPeerConnectionAndStartSession() {
     if (peerConnectionQueue.length > 0) {
@@ -764,6 +1320,7 @@ function waitForPeerConnectionAndStartSession() {
 // Connect to TTS Avatar Service (exactly as in Azure sample)
 function connectToAvatarService(peerConn) {
     let localSdp = btoa(JSON.stringify(peerConn.localDescription));
+    peerConnection = peerConn;
     
     // Get avatar configuration from UI
     const isCustom = document.getElementById('isCustomAvatar').checked;
@@ -801,6 +1358,14 @@ function connectToAvatarService(peerConn) {
         headers['TtsVoice'] = ttsVoice;
     }
 
+    if (iceServerRegion) {
+        headers['SpeechRegion'] = iceServerRegion;
+    }
+
+    if (requestedQualityProfile) {
+        headers['QualityProfile'] = requestedQualityProfile;
+    }
+
     fetch('/api/connectAvatar', {
         method: 'POST',
         headers: headers,
@@ -808,10 +1373,24 @@ function connectToAvatarService(peerConn) {
     })
     .then(response => {
         if (response.ok) {
+            currentQualityProfile = response.headers.get('AvatarQualityProfile');
+            requestedQualityProfile = undefined;
+            if (audioOnlyReason) {
+                endAudioOnlyMode();
+            }
             response.text().then(text => {
                 const remoteSdp = text;
                 peerConn.setRemoteDescription(new RTCSessionDescription(JSON.parse(atob(remoteSdp))));
             });
+        } else if (response.status === 503 && response.headers.get('AvatarUnavailable')) {
+            // No avatar capacity: keep talking with audio only until the server says it's back
+            peerConn.close();
+            peerConnection = undefined;
+            if (audioOnlyReason) {
+                isReconnecting = false;
+            } else {
+                startAudioOnlySession(response.headers.get('AvatarUnavailable')).catch(error => console.error(error));
+            }
         } else {
             document.getElementById('startAvatarButton').disabled = false;
             throw new Error(`Failed connecting to the Avatar service: ${response.status} ${response.statusText}`);
@@ -822,6 +1401,9 @@ function connectToAvatarService(peerConn) {
 // Connect avatar (matching Azure sample flow)
 function connectAvatarService() {
     document.getElementById('startAvatarButton').disabled = true;
+    openSpeechEventStream();
+    // Warm up the Speech SDK in the background; voice input is likely during an avatar session
+    loadSpeechSDK().catch(error => console.warn('Speech SDK preload failed:', error));
     waitForPeerConnectionAndStartSession();
     lastInteractionTime = new Date();
     userClosedSession = false;
@@ -845,6 +1427,9 @@ function disconnectAvatar(closeSpeechRecognizer = false) {
     }
 
     sessionActive = false;
+    stopStatsCollection();
+    closeSpeechEventStream();
+    endAudioOnlyMode();
     
     // Disable stop avatar button when session ends
     const stopAvatarButton = document.getElementById('stopAvatarButton');
@@ -938,13 +1523,5 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('stopAvatarButton').addEventListener('click', function() {
         window.stopSession();
     });
-    
-    // Initialize with disabled mic button until speech SDK is ready
-    document.getElementById('startMicButton').disabled = true;
-    
-    // Initialize speech config when page loads
-    initializeSpeechConfig().then(() => {
-        document.getElementById('startMicButton').disabled = false;
-    });
 });
 
@@ -0,0 +1,363 @@
+"""Traffic capture and deterministic replay of DirectLine and Speech interactions.
+
+Capture mode is enabled by setting TRAFFIC_CAPTURE_FILE (read by app.create_app()). Every DirectLine call made
+by the app and every avatar synthesizer call is then appended to that file as one
+compact JSON line, with tokens, keys and other secrets scrubbed.
+
+Replay mode plays a trace back against the app, with stand-ins serving the recorded
+responses, and compares per-stage timings against a baseline trace:
+
+    python traffic_capture.py replay trace.jsonl --speed 10 --baseline baseline.jsonl
+    python traffic_capture.py compare baseline.jsonl trace.jsonl
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+SCRUBBED = '<scrubbed>'
+SECRET_KEYS = {'token', 'authorization', 'password', 'username', 'credential',
+               'key', 'secret', 'subscription', 'streamurl', 'ocp-apim-subscription-key'}
+BEARER_PATTERN = re.compile(r'Bearer\s+[^\s"\']+')
+
+
+def scrub(value):
+    """Return a copy of value with secrets replaced, recursing into dicts and lists."""
+    if isinstance(value, dict):
+        return {k: SCRUBBED if k.lower() in SECRET_KEYS else scrub(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    if isinstance(value, str):
+        return BEARER_PATTERN.sub(f'Bearer {SCRUBBED}', value)
+    return value
+
+
+class TrafficRecorder:
+    """Appends timed interaction events to a JSONL trace (or an in-memory list)."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = [] if path is None else None
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+
+    def record(self, stage, duration_ms, **fields):
+        event = {'t': round(time.monotonic() - self._start, 4), 'stage': stage, 'ms': round(duration_ms, 2)}
+        event.update(scrub({k: v for k, v in fields.items() if v is not None}))
+        with self._lock:
+            if self._file:
+                self._file.write(json.dumps(event, separators=(',', ':')) + '\n')
+                self._file.flush()
+            else:
+                self.events.append(event)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+recorder = None
+_local = threading.local()  # Stack of the calling thread's open span events
+
+
+def configure(path):
+    """Start capturing to the JSONL file at path, or stop capturing if path is empty."""
+    global recorder
+    if recorder:
+        recorder.close()
+    recorder = TrafficRecorder(path) if path else None
+
+
+@contextlib.contextmanager
+def span(stage, **fields):
+    """Time the wrapped call and record it as one event; a no-op when capture is off.
+
+    The yielded dict can be filled with result fields (status, response, ...).
+    """
+    if recorder is None:
+        yield {}
+        return
+    event = dict(fields)
+    spans = _local.__dict__.setdefault('spans', [])
+    spans.append(event)
+    started = time.perf_counter()
+    try:
+        yield event
+    except Exception as e:
+        event['error'] = str(e)
+        raise
+    finally:
+        spans.pop()
+        recorder.record(stage, (time.perf_counter() - started) * 1000, **event)
+
+
+def standin_sleep(recorded_ms, speed):
+    """Sleep for a stand-in's recorded latency at replay speed, noting both on the enclosing span.
+
+    The span's time minus standin_ms is the app's own overhead, which replay doesn't speed up.
+    """
+    slept_ms = recorded_ms / speed
+    time.sleep(slept_ms / 1000)
+    spans = getattr(_local, 'spans', None)
+    if spans:
+        spans[-1]['standin_ms'] = spans[-1].get('standin_ms', 0) + slept_ms
+        spans[-1]['replayed_ms'] = spans[-1].get('replayed_ms', 0) + recorded_ms
+
+
+def directline_stage(method, url):
+    """Name the trace stage of a DirectLine call from its method and URL."""
+    if url.endswith('/tokens/generate'):
+        return 'directline.generate_token'
+    if url.endswith('/conversations'):
+        return 'directline.start_conversation'
+    if url.endswith('/activities'):
+        return 'directline.send_message' if method == 'POST' else 'directline.get_activities'
+    return 'directline.other'
+
+
+def load_trace(path):
+    """Read a JSONL trace, skipping blank or corrupt lines."""
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt trace line {line_number} in {path}")
+    return events
+
+
+def stage_timings(events):
+    """Group event durations (ms) by stage, with replayed stand-in latency restored to real speed."""
+    timings = defaultdict(list)
+    for event in events:
+        timings[event['stage']].append(event['ms'] - event.get('standin_ms', 0) + event.get('replayed_ms', 0))
+    return timings
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def compare_timings(baseline, candidate, threshold=0.2):
+    """Compare per-stage p50/p95 timings; return report rows and the regressed stages.
+
+    A baseline stage the candidate never reached counts as a regression.
+    """
+    rows = []
+    regressions = []
+    for stage in sorted(set(baseline) | set(candidate)):
+        base, cand = baseline.get(stage), candidate.get(stage)
+        row = {'stage': stage, 'baseline_n': len(base or []), 'candidate_n': len(cand or [])}
+        if base and not cand:
+            regressions.append(stage)
+        if base and cand:
+            row.update({
+                'baseline_p50': statistics.median(base), 'candidate_p50': statistics.median(cand),
+                'baseline_p95': _percentile(base, 0.95), 'candidate_p95': _percentile(cand, 0.95),
+            })
+            row['delta'] = (row['candidate_p50'] - row['baseline_p50']) / row['baseline_p50'] if row['baseline_p50'] else 0.0
+            if row['delta'] > threshold:
+                regressions.append(stage)
+        rows.append(row)
+    return rows, regressions
+
+
+def format_report(rows, regressions):
+    lines = [f"{'stage':<32} {'n':>5} {'base p50':>10} {'new p50':>10} {'base p95':>10} {'new p95':>10} {'delta':>8}"]
+    for row in rows:
+        flag = '  REGRESSION' if row['stage'] in regressions else ''
+        if 'delta' not in row:
+            lines.append(f"{row['stage']:<32} {row['candidate_n']:>5} (only in {'baseline' if row['baseline_n'] else 'candidate'}){flag}")
+            continue
+        lines.append(f"{row['stage']:<32} {row['candidate_n']:>5} {row['baseline_p50']:>10.1f} {row['candidate_p50']:>10.1f} "
+                     f"{row['baseline_p95']:>10.1f} {row['candidate_p95']:>10.1f} {row['delta']:>+7.0%}{flag}")
+    return '\n'.join(lines)
+
+
+class ReplayResponse:
+    """Stand-in for a requests.Response rebuilt from a recorded event."""
+
+    def __init__(self, event):
+        self.status_code = event.get('status', 599)
+        self.headers = event.get('headers', {})
+        body = event.get('response', '')
+        self.text = body if isinstance(body, str) else json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ScaledTime:
+    """Stand-in for the time module whose sleep() runs `speed` times faster."""
+
+    def __init__(self, speed):
+        self.speed = speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class ReplayTransport:
+    """Serves recorded DirectLine responses in order, per stage, with recorded latency."""
+
+    def __init__(self, events, speed):
+        self.speed = speed
+        self.queues = defaultdict(deque)
+        for event in events:
+            if event['stage'].startswith('directline.'):
+                self.queues[event['stage']].append(event)
+
+    def request(self, method, url, **kwargs):
+        stage = directline_stage(method, url)
+        queue = self.queues.get(stage)
+        if not queue:
+            logger.warning(f"Trace exhausted for stage {stage}")
+            return ReplayResponse({'status': 599, 'response': 'trace exhausted'})
+        event = queue.popleft()
+        standin_sleep(event['ms'], self.speed)
+        return ReplayResponse(event)
+
+
+class ReplaySynthesizer:
+    """Stand-in SpeechSynthesizer that replays recorded speak latencies for one client."""
+
+    def __init__(self, queue, speed, completed_reason):
+        self.queue = queue
+        self.speed = speed
+        self.completed_reason = completed_reason
+
+    def speak_ssml_async(self, ssml):
+        return self
+
+    speak_text_async = speak_ssml_async
+
+    def get(self):
+        event = self.queue.popleft() if self.queue else {'ms': 0}
+        standin_sleep(event['ms'], self.speed)
+        return _ReplayResult(self.completed_reason, event.get('result_id', 'replay'))
+
+
+class _ReplayResult:
+    def __init__(self, reason, result_id):
+        self.reason = reason
+        self.result_id = result_id
+
+
+class _ReplayConnection:
+    def send_message_async(self, path, payload):
+        return self
+
+    def get(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def replay(events, speed=1.0):
+    """Play a trace back against the app through stand-ins and return the replayed events.
+
+    Chat turns are re-issued to /chat and speak calls to /api/speak at their recorded
+    offsets (divided by speed); DirectLine and the avatar synthesizer are stand-ins
+    serving the recorded responses and latencies. Avatar connects are not re-negotiated:
+    the stand-in synthesizer is installed after waiting for the recorded connect time.
+    """
+    global recorder
+    import app as app_module
+
+    transport = ReplayTransport(events, speed)
+    speak_queues = defaultdict(deque)
+    for event in events:
+        if event['stage'] == 'speech.speak':
+            speak_queues[event.get('client_id', 'default_client')].append(event)
+
+    flask_app = app_module.create_app()
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    saved = (recorder, app_module.directline_transport, app_module.time)
+    recorder = TrafficRecorder()
+    app_module.directline_transport = transport
+    app_module.time = ScaledTime(speed)
+    app_module.background_tasks_pid = os.getpid()  # No token refreshers against real endpoints
+    completed = app_module.speechsdk.ResultReason.SynthesizingAudioCompleted
+    try:
+        client = flask_app.test_client()
+        started = time.monotonic()
+        for event in events:
+            stage = event['stage']
+            if stage not in ('directline.send_message', 'speech.connect', 'speech.speak'):
+                continue
+            delay = event['t'] / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            client_id = event.get('client_id', 'default_client')
+            if stage == 'directline.send_message':
+                message = (event.get('request') or {}).get('text', '')
+                client.post('/chat', json={'message': message})
+            elif stage == 'speech.connect':
+                with span('speech.connect', client_id=client_id):
+                    standin_sleep(event['ms'], speed)
+                app_module.speech_synthesizers[client_id] = ReplaySynthesizer(speak_queues[client_id], speed, completed)
+                app_module.avatar_connections[client_id] = _ReplayConnection()
+            else:
+                if client_id not in app_module.speech_synthesizers:
+                    app_module.speech_synthesizers[client_id] = ReplaySynthesizer(speak_queues[client_id], speed, completed)
+                client.post('/api/speak', data=event.get('ssml', ''), headers={'ClientId': client_id})
+        return recorder.events
+    finally:
+        recorder, app_module.directline_transport, app_module.time = saved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    replay_parser = subparsers.add_parser('replay', help='Replay a trace against the app through stand-ins')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier (default: real speed)')
+    replay_parser.add_argument('--baseline', help='Baseline trace to compare against (default: the replayed trace)')
+    replay_parser.add_argument('--output', help='Write the replayed events to this JSONL file')
+    replay_parser.add_argument('--threshold', type=float, default=0.2, help='p50 slowdown flagged as a regression')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare per-stage timings of two traces')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('trace')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='p50 slowdown flagged as a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'replay':
+        events = load_trace(args.trace)
+        replayed = replay(events, args.speed)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                for event in replayed:
+                    f.write(json.dumps(event, separators=(',', ':')) + '\n')
+        baseline = load_trace(args.baseline) if args.baseline else events
+        rows, regressions = compare_timings(stage_timings(baseline), stage_timings(replayed), args.threshold)
+    else:
+        rows, regressions = compare_timings(stage_timings(load_trace(args.baseline)), stage_timings(load_trace(args.trace)), args.threshold)
+    print(format_report(rows, regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    # Run through the importable module so app.py and the replay share one recorder
+    import traffic_capture
+    raise SystemExit(traffic_capture.main())